@@ -0,0 +1,84 @@
+"""
+Measure insert throughput and latency of the `fiutils.db` ingest profiles.
+
+Rows are generated with the same `Parameter`s as `notebooks/000-simple-template.py`
+(with a fixed seed), so they have the shape of the template's `p.__dict__`. Every
+row is appended with its own `db_append_row` call, like the template does.
+
+```
+python benchmarks/bench_db_ingest.py [rows] [batch]
+```
+"""
+from contextlib import closing
+from itertools import islice
+from pathlib import Path
+import sqlite3
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from fiutils.db import DB_PROFILES, db_append_row, db_create_indexes, db_setup
+from fiutils.params import Parameter, Parameter2D, pproduct
+
+VERDICTS = ['NORMAL00', 'NORMAL00', 'NORMAL00', 'GLITCH00', 'MUTE00', 'ERROR00']
+
+def shot_rows(n: int, seed: int=0) -> "list[dict]":
+    np.random.seed(seed)
+    params = [
+        Parameter('target_v', 2.4, itype='fixed'),
+        Parameter('scan', max=500_000, itype='range'),
+        Parameter2D('xy_scanner', 0, 100, 0, 200, 10, 20),
+        Parameter('scan_per_point', max=100, itype='range'),
+        Parameter('glitch_delay_ns', 10, 10_000),
+        Parameter('glitch_time_ns', 50, 1200),
+        Parameter('glitch_v', 0.0, 1.5, dtype='float'),
+    ]
+    verdicts = np.random.choice(VERDICTS, n)
+    rows = []
+    for idx, settings in enumerate(islice(pproduct(params), n)):
+        settings['idx'] = idx
+        settings['verdict'] = str(verdicts[idx])
+        settings['stop'] = False
+        settings['do_move'] = False
+        settings['iter_t'] = int(np.random.randint(100_000, 200_000))
+        settings['do_reset'] = settings['verdict'] not in ['NORMAL00', 'GLITCH00']
+        rows.append(settings)
+    return rows
+
+def bench_profile(profile: str, rows: "list[dict]", batch: int=1) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        db_name = Path(tmp) / 'bench.db'
+        table_name = 'tab_bench'
+        latencies = np.empty((len(rows) + batch - 1) // batch, dtype=np.int64)
+        with closing(sqlite3.connect(db_name)) as db:
+            settings = db_setup(db, profile)
+            t_start = time.perf_counter_ns()
+            for i, start in enumerate(range(0, len(rows), batch)):
+                data = rows[start] if batch == 1 else rows[start:start + batch]
+                t0 = time.perf_counter_ns()
+                db_append_row(db, table_name, data, defer_index=settings['defer_index'])
+                latencies[i] = time.perf_counter_ns() - t0
+            if settings['defer_index']:
+                db_create_indexes(db, table_name)
+            t_total = time.perf_counter_ns() - t_start
+        size = db_name.stat().st_size
+    return {
+        'profile': profile,
+        'rows/s': len(rows) / (t_total / 1e9),
+        'p50_us': np.percentile(latencies, 50) / 1e3,
+        'p99_us': np.percentile(latencies, 99) / 1e3,
+        'db_kib': size / 1024,
+    }
+
+def main(n: int=20_000, batch: int=1):
+    rows = shot_rows(n)
+    print(f'{n=} {batch=} keys={list(rows[0].keys())}')
+    print(f'{"profile":>8} {"rows/s":>10} {"p50_us":>10} {"p99_us":>10} {"db_kib":>10}')
+    for profile in DB_PROFILES:
+        res = bench_profile(profile, rows, batch)
+        print(f'{res["profile"]:>8} {res["rows/s"]:>10.0f} {res["p50_us"]:>10.1f} {res["p99_us"]:>10.1f} {res["db_kib"]:>10.0f}')
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:3]))
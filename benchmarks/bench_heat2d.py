@@ -0,0 +1,58 @@
+"""
+Measure the histograms behind `fiutils.plot.multi_heat2d`: all pairs of dims of
+a frame shaped like the template's runs, binned with `bin_cut` and counted with
+a `groupby` per pair (how it used to be done), and with `bin_codes` and
+`hist2d_codes`. Only the counting, not the plotting.
+
+```
+python benchmarks/bench_heat2d.py [rows] [bins]
+```
+"""
+from itertools import combinations
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from fiutils.plot import bin_codes, bin_cut, bin_labels, hist2d_codes
+
+DIMS = ['xy_scanner0', 'xy_scanner1', 'glitch_delay_ns', 'glitch_time_ns', 'glitch_v']
+
+def shot_frame(n: int, seed: int=0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'xy_scanner0': rng.integers(0, 10, n) * 100 / 9,
+        'xy_scanner1': rng.integers(0, 20, n) * 200 / 19,
+        'glitch_delay_ns': rng.integers(10, 10_000, n),
+        'glitch_time_ns': rng.integers(50, 1200, n),
+        'glitch_v': rng.uniform(0, 1.5, n),
+        'verdict': pd.Categorical(rng.choice(['NORMAL00', 'GLITCH00', 'MUTE00'], n, p=[.9, .01, .09])),
+    })
+
+def hists_groupby(df: pd.DataFrame, bins: int, filter: pd.Series) -> list:
+    df_binned = bin_cut(df, DIMS, bins=bins)
+    for dim in DIMS:
+        df_binned[dim] = df_binned[dim].apply(str)
+    return [df_binned[filter].reset_index().groupby([y, x], observed=False)['index'].count().unstack()
+            for x, y in combinations(DIMS, 2)]
+
+def hists_codes(df: pd.DataFrame, bins: int, filter: pd.Series) -> list:
+    codes, edges = bin_codes(df, DIMS, bins=bins)
+    labels = {dim: bin_labels(edges[dim]) for dim in DIMS}
+    mask = filter.to_numpy()
+    return [pd.DataFrame(hist2d_codes(codes[x], codes[y], len(labels[x]), len(labels[y]), mask),
+                         index=labels[y], columns=labels[x])
+            for x, y in combinations(DIMS, 2)]
+
+def main(n: int=1_000_000, bins: int=10):
+    df = shot_frame(n)
+    filter = df.verdict == 'GLITCH00'
+    print(f'{n=} {bins=} pairs={len(list(combinations(DIMS, 2)))}')
+    for name, f in [('groupby', hists_groupby), ('codes', hists_codes)]:
+        t0 = time.perf_counter()
+        f(df, bins, filter)
+        print(f'{name:>8} {time.perf_counter() - t0:>8.3f} s')
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:3]))
@@ -0,0 +1,64 @@
+"""
+Import-time budget for the core modules of fiutils.
+
+Every module is imported in a fresh interpreter with `-X importtime`, a few times,
+and the fastest cumulative import time is compared to its budget. On top of that,
+modules must not pull in any of the heavy packages listed for them, which does not
+depend on how fast the machine is. Exits with 1 on any regression, so it can be
+used as a check.
+
+```
+python benchmarks/bench_importtime.py [scale]
+```
+
+`scale` multiplies the budgets, for slow machines.
+"""
+import subprocess
+import sys
+
+# module: (budget in ms, packages it must not import)
+BUDGETS = {
+    'fiutils':          (10, ['numpy', 'tqdm', 'serial', 'pandas', 'holoviews']),
+    'fiutils.db':       (60, ['numpy', 'pandas']),
+    'fiutils.utils':    (80, ['numpy', 'tqdm', 'serial', 'pandas']),
+    'fiutils.campaign': (80, ['numpy', 'tqdm', 'pandas']),
+    'fiutils.hardware': (40, ['serial', 'numpy']),
+    'fiutils.params':   (400, ['tqdm', 'pandas']),
+    'fiutils.stats':    (400, ['tqdm', 'pandas']),
+}
+
+REPEAT = 5
+
+def import_time(module: str) -> "tuple[float, set[str]]":
+    # Returns (cumulative import time in ms, top level packages imported)
+    best = None
+    for _ in range(REPEAT):
+        res = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                             capture_output=True, text=True, check=True)
+        imported = set()
+        for line in res.stderr.splitlines():
+            if not line.startswith('import time:') or 'cumulative' in line:
+                continue
+            _, cumulative, name = line.split('|')
+            name = name.strip()
+            imported.add(name.split('.')[0])
+            if name == module:
+                t = int(cumulative) / 1000
+        best = t if best is None else min(best, t)
+    return best, imported
+
+def main(scale: float=1.0) -> int:
+    failed = 0
+    print(f'{"module":<20} {"ms":>8} {"budget":>8}  result')
+    for module, (budget, forbidden) in BUDGETS.items():
+        t, imported = import_time(module)
+        problems = []
+        if t > budget * scale:
+            problems.append('over budget')
+        problems += [f'imports {pkg}' for pkg in forbidden if pkg in imported]
+        failed += bool(problems)
+        print(f'{module:<20} {t:>8.1f} {budget * scale:>8.0f}  {", ".join(problems) or "ok"}')
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main(*map(float, sys.argv[1:2])))
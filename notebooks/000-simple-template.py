@@ -19,11 +19,17 @@ from pprint import pformat
 from contextlib import closing
 from types import SimpleNamespace
 
-from fiutils.utils import setup_file_logger, setup_db, setup_params
-from fiutils.db import db_append_row
+from fiutils.utils import setup_file_logger, setup_db, setup_params, setup_profiler, RateLimiter
+from fiutils.trace import setup_trace
+from fiutils.db import db_append_row, db_setup
 from fiutils.params import Parameter, Parameter2D, pproduct, ptotal, pdump
+from fiutils.timing import ShotTimer
+from fiutils.monitor import setup_monitor
+from fiutils.control import setup_control, SKIP, STOP
 
 setup_file_logger(__file__, timestamp)
+# Chrome/Perfetto trace of the last shots, written to logs/ at exit
+setup_trace(__file__, timestamp)
 lm.info(f'I identify as {__file__}, {timestamp}')
 
 db_name, table_name, hist = setup_db(__file__, timestamp)
@@ -46,36 +52,56 @@ prev_xy_scanner0 = None
 prev_xy_scanner1 = None
 do_move = False
 do_reset = True
+log_shot = RateLimiter(1.0)
+# A reset follows every failing shot, only log a sample of them
+log_reset = RateLimiter(1.0)
+# Failing shots since the last log, they get one error line per log_shot
+resets_needed = 0
+timer = ShotTimer('reset', 'move', 'glitch')
+# Live shots/s, verdict rates and latencies on the progress bar and in logs/
+monitor = setup_monitor(__file__, timestamp, progress=progress, timer=timer)
+# FIUTILS_PROFILE=<shots> python <script> to profile the first shots
+profiler = setup_profiler(__file__, timestamp)
+# Ctrl-C pauses, see fiutils.control for the other commands
+control = setup_control(__file__, timestamp, skip_keys=('xy_scanner0', 'xy_scanner1'))
 
 with closing(sqlite3.connect(db_name)) as db:
+    # 'fast' trades durability on power loss for throughput, see fiutils.db.DB_PROFILES
+    db_setup(db, 'safe')
     for idx, settings in progress:
-        try:
-            t0 = time.time()*1000
-            p = SimpleNamespace(**settings)
+        # Pause/skip/stop requests take effect here, between shots
+        action = control.at_boundary(settings)
+        if action == SKIP:
+            continue
+        elif action == STOP:
+            break
+
+        p = SimpleNamespace(**settings)
+        shot = timer.shot(p)
 
-            p.idx = idx
-            p.verdict = 'NORMAL00'
-            p.stop = False
-            p.do_move = do_move
+        p.idx = idx
+        p.verdict = 'NORMAL00'
+        p.stop = False
+        p.do_move = do_move
 
-            with progress.external_write_mode():
-                lm.info(f'{idx=}')
+        if do_reset:
+            if log_reset():
+                lm.warning('Reset!')
             
-            if do_reset:
-                with progress.external_write_mode():
-                    lm.warning('Reset!')
-                
+            with shot.span('reset'):
                 time.sleep(.1)
-                do_reset = False
+            do_reset = False
+        
+        if do_move and (prev_xy_scanner0 != p.xy_scanner0 or prev_xy_scanner1 != p.xy_scanner1):
+            lm.info(f'Moving to {p.xy_scanner0},{p.xy_scanner1}')
+            prev_xy_scanner0 = p.xy_scanner0
+            prev_xy_scanner1 = p.xy_scanner1
             
-            if do_move and (prev_xy_scanner0 != p.xy_scanner0 or prev_xy_scanner1 != p.xy_scanner1):
-                with progress.external_write_mode():
-                    lm.info(f'Moving to {p.xy_scanner0},{p.xy_scanner1}')
-                prev_xy_scanner0 = p.xy_scanner0
-                prev_xy_scanner1 = p.xy_scanner1
-                
+            with shot.span('move'):
                 time.sleep(.5)
 
+        # Arm, trigger and classify here
+        with shot.span('glitch'):
             if (p.glitch_v * p.glitch_time_ns) > 1000:
                 p.verdict = 'MUTE00'
             elif 400 < (p.glitch_v * p.glitch_time_ns) < 500:
@@ -88,36 +114,36 @@ with closing(sqlite3.connect(db_name)) as db:
                     pass
             else:
                 pass
-            
-            if p.verdict not in ['NORMAL00', 'GLITCH00']:
-                with progress.external_write_mode():
-                    lm.error('Yikes, need a reset!')
-                    do_reset = True
-
-            p.iter_t = time.time_ns() - t0
-            p.do_reset = do_reset
-
-            try:
-                hist[p.verdict] += 1
-            except KeyError:
-                hist[p.verdict] = 1
-            
-            with progress.external_write_mode():
-                lm.info(pformat(p))
-                lm.info(pformat(hist))
-            
-            db_append_row(db, table_name, p.__dict__)
         
-        except KeyboardInterrupt:
-            try:
-                x = input('\n[c]ontinue/[q]uit?\n> ')
-            except KeyboardInterrupt:
-                break
-            if x == 'c':
-                continue
-            elif x == 'q':
-                break
-            else:
-                pass
+        if p.verdict not in ['NORMAL00', 'GLITCH00']:
+            resets_needed += 1
+            do_reset = True
+
+        p.do_reset = do_reset
+        shot.done()
+
+        try:
+            hist[p.verdict] += 1
+        except KeyError:
+            hist[p.verdict] = 1
+        monitor.shot(p.verdict)
+        profiler.shot()
+        
+        # Every shot is in the db, only log a sample
+        if log_shot():
+            if resets_needed:
+                lm.error(f'Yikes, {resets_needed} shots needed a reset!')
+                resets_needed = 0
+            lm.info(pformat(p))
+            lm.info(pformat(hist))
+            lm.info(timer.summary())
+        
+        # Resuming a table from before the timer (with iter_t) adds the t_*_ns columns to it,
+        # iter_t is NULL for the new shots
+        with timer.span('db'):
+            db_append_row(db, table_name, p.__dict__)
 
+if resets_needed:
+    lm.error(f'Yikes, {resets_needed} shots needed a reset!')
+monitor.stop()
 lm.info('Thank you, bye!')
@@ -0,0 +1,124 @@
+import sys, os, logging
+from fiutils.utils import get_run_id, setup_logger
+lm = setup_logger('main')
+__file__, timestamp = get_run_id('010-campaign-template')
+try:
+    # If a timestampe is pass as argument, use that one instead
+    timestamp = sys.argv[1]
+    lm.info(f're-using {timestamp=}')
+except IndexError:
+    pass
+with open('last_timestamp', 'w') as f:
+    f.write(timestamp)
+
+import time
+
+from pprint import pformat
+
+from fiutils.utils import setup_file_logger, setup_db, setup_params, setup_profiler, RateLimiter
+from fiutils.trace import setup_trace
+from fiutils.campaign import Campaign
+from fiutils.control import setup_control
+from fiutils.monitor import setup_monitor
+from fiutils.params import Parameter, Parameter2D
+
+setup_file_logger(__file__, timestamp)
+# Chrome/Perfetto trace of the last shots, written to logs/ at exit
+setup_trace(__file__, timestamp)
+lm.info(f'I identify as {__file__}, {timestamp}')
+
+db_name, table_name, hist = setup_db(__file__, timestamp)
+lm.info(f'{db_name=} {table_name=}')
+lm.info(f'{pformat(hist)=}')
+
+xy_stops = (10, 20)
+
+progress = setup_params(__file__, timestamp,
+    Parameter('target_v', 2.4, itype='fixed'),
+    Parameter('scan', max=500_000, itype='range'),
+    Parameter2D('xy_scanner', 0, 100, 0, 200, *xy_stops),
+    Parameter('scan_per_point', max=100, itype='range'),
+    Parameter('glitch_delay_ns', 10, 10_000),
+    Parameter('glitch_time_ns', 50, 1200),
+    Parameter('glitch_v', 0.0, 1.5, dtype='float'),
+)
+
+# State shared between the stages
+state = {
+    'prev_xy': None,
+    'do_move': False,
+    'do_reset': True,
+}
+
+# A reset follows every failing shot, only log a sample of them
+log_reset = RateLimiter(1.0)
+
+def reset(p):
+    if state['do_reset']:
+        if log_reset():
+            lm.warning('Reset!')
+        time.sleep(.1)
+        state['do_reset'] = False
+
+def move(p):
+    p.do_move = state['do_move']
+    if p.do_move and state['prev_xy'] != (p.xy_scanner0, p.xy_scanner1):
+        lm.info(f'Moving to {p.xy_scanner0},{p.xy_scanner1}')
+        state['prev_xy'] = (p.xy_scanner0, p.xy_scanner1)
+        time.sleep(.5)
+
+def arm_and_trigger(p):
+    # Arm the glitcher and trigger the target here
+    pass
+
+def classify(p):
+    if (p.glitch_v * p.glitch_time_ns) > 1000:
+        p.verdict = 'MUTE00'
+    elif 400 < (p.glitch_v * p.glitch_time_ns) < 500:
+        if 3000 < p.glitch_delay_ns < 5000:
+            p.verdict = 'GLITCH00'
+        elif p.glitch_delay_ns > 9900:
+            p.verdict = 'ERROR00'
+            p.stop = True
+
+    if p.verdict not in ['NORMAL00', 'GLITCH00']:
+        state['do_reset'] = True
+    p.do_reset = state['do_reset']
+
+log_shot = RateLimiter(1.0)
+# Failing shots since the last log, only touched by `log`, they get one error line per log_shot
+resets_needed = 0
+
+def log(row, hist):
+    # Runs on the campaign's worker thread, every shot is in the db, only log a sample
+    global resets_needed
+    if row['verdict'] not in ['NORMAL00', 'GLITCH00']:
+        resets_needed += 1
+    if log_shot():
+        if resets_needed:
+            lm.error(f'Yikes, {resets_needed} shots needed a reset!')
+            resets_needed = 0
+        lm.info(pformat(row))
+        lm.info(pformat(hist))
+
+campaign = Campaign(db_name, table_name, {
+    'reset': reset,
+    'move': move,
+    'arm_and_trigger': arm_and_trigger,
+    'classify': classify,
+}, hist=hist, log=log, monitor=setup_monitor(__file__, timestamp, progress=progress),
+    # FIUTILS_PROFILE=<shots> python <script> to profile the first shots
+    profiler=setup_profiler(__file__, timestamp),
+    # Ctrl-C pauses, see fiutils.control for the other commands
+    control=setup_control(__file__, timestamp, skip_keys=('xy_scanner0', 'xy_scanner1')))
+
+try:
+    hist = campaign.run(progress)
+except KeyboardInterrupt:
+    lm.warning('Interrupted, stored the shots done so far')
+campaign.monitor.stop()
+if resets_needed:
+    lm.error(f'Yikes, {resets_needed} shots needed a reset!')
+
+lm.info(pformat(hist))
+lm.info('Thank you, bye!')
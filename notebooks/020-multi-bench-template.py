@@ -0,0 +1,88 @@
+import sys, os, logging
+from fiutils.utils import get_run_id, setup_logger
+lm = setup_logger('main')
+__file__, timestamp = get_run_id('020-multi-bench-template')
+try:
+    # If a timestampe is pass as argument, use that one instead
+    timestamp = sys.argv[1]
+    lm.info(f're-using {timestamp=}')
+except IndexError:
+    pass
+with open('last_timestamp', 'w') as f:
+    f.write(timestamp)
+
+import time
+
+from pprint import pformat
+
+from fiutils.utils import setup_file_logger, setup_db, setup_params
+from fiutils.hardware import find_spider, find_stlink_uart
+from fiutils.monitor import setup_monitor
+from fiutils.orchestrator import Orchestrator, find_benches
+from fiutils.params import Parameter, Parameter2D
+
+setup_file_logger(__file__, timestamp)
+lm.info(f'I identify as {__file__}, {timestamp}')
+
+db_name, table_name, hist = setup_db(__file__, timestamp)
+lm.info(f'{db_name=} {table_name=}')
+
+params = [
+    Parameter('target_v', 2.4, itype='fixed'),
+    Parameter2D('xy_scanner', 0, 100, 0, 200, 10, 20),
+    Parameter('scan_per_point', max=1000, itype='range'),
+    Parameter('glitch_delay_ns', 10, 10_000),
+    Parameter('glitch_time_ns', 50, 1200),
+    Parameter('glitch_v', 0.0, 1.5, dtype='float'),
+]
+progress = setup_params(__file__, timestamp, *params)
+
+# One bench per set of devices that is found, every device goes to one bench only
+benches = find_benches({'spider': find_spider, 'target': find_stlink_uart})
+if not benches:
+    lm.warning('No benches found, running two without hardware')
+    benches = [{'spider': None, 'target': None}] * 2
+lm.info(f'{benches=}')
+
+def setup(bench):
+    # Runs in the process of the bench: open its devices here, the stages use them
+    # glitcher = Chronology(bench['spider'])
+    state = {'do_reset': True}
+
+    def reset(p):
+        if state['do_reset']:
+            lm.warning(f'Reset {bench["target"]}!')
+            time.sleep(.1)
+            state['do_reset'] = False
+
+    def arm_and_trigger(p):
+        # Arm the glitcher and trigger the target here
+        time.sleep(.001)
+
+    def classify(p):
+        if (p.glitch_v * p.glitch_time_ns) > 1000:
+            p.verdict = 'MUTE00'
+        elif 400 < (p.glitch_v * p.glitch_time_ns) < 500 and 3000 < p.glitch_delay_ns < 5000:
+            p.verdict = 'GLITCH00'
+
+        if p.verdict not in ['NORMAL00', 'GLITCH00']:
+            state['do_reset'] = True
+        p.do_reset = state['do_reset']
+
+    return {
+        'reset': reset,
+        'arm_and_trigger': arm_and_trigger,
+        'classify': classify,
+    }
+
+# A re-used timestamp runs the idx ranges that are missing from its table
+orchestrator = Orchestrator(db_name, table_name, setup, benches, params,
+                            resume=True, hist=hist, progress=progress,
+                            monitor=setup_monitor(__file__, timestamp, progress=progress))
+# Ctrl-C stops all benches after their current shot
+hist = orchestrator.run()
+orchestrator.monitor.stop()
+
+lm.info(f'\n{orchestrator.summary()}')
+lm.info(pformat(hist))
+lm.info('Thank you, bye!')
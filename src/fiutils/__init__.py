@@ -0,0 +1,30 @@
+import importlib
+
+# Submodules are imported on first access (`fiutils.plot`), `import fiutils` itself is free
+_SUBMODULES = {
+    'archive',
+    'campaign',
+    'control',
+    'db',
+    'hardware',
+    'monitor',
+    'openocd',
+    'orchestrator',
+    'params',
+    'plot',
+    'report',
+    'shotlog',
+    'stats',
+    'stm32',
+    'timing',
+    'trace',
+    'utils',
+}
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return importlib.import_module(f'.{name}', __name__)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+def __dir__():
+    return sorted(set(globals()) | _SUBMODULES)
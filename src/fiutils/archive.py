@@ -0,0 +1,163 @@
+import argparse
+from contextlib import closing
+import datetime
+from pathlib import Path
+import re
+import sqlite3
+
+from .db import VERDICT_COLUMN, db_checkpoint, db_create_indexes, db_setup, db_verdict_codes, db_verdict_sql
+
+"""
+Compact the per-script databases in `data/` into a single archive.
+
+```
+python -m fiutils.archive archive.db data/*.db --bins 20 [--drop]
+```
+
+Every source database is one partition of the archive: all its `tab_*` run tables
+go into `arc_<script>`, with the name of the run table in an extra `run` column.
+Columns that only some runs have are added as they show up (NULL for the others).
+Verdicts are dictionary encoded in the archive, see `fiutils.db`.
+
+Next to the shots, the archive keeps
+- `runs`: one row per archived run (script, run, source, number of shots, when)
+- `rollup`: per run, per numeric column, verdict counts in `bins` equal width bins
+  over the range of that run, so dashboards do not have to touch the shots at all.
+
+Runs that are already in `runs` are skipped, so it is safe to re-run on the same
+sources. With `drop`, run tables that are in the archive (now or from an earlier
+run) are removed from their source, which is then VACUUMed. The archive is
+checkpointed and synced to disk before anything is dropped.
+"""
+
+RUN_PREFIX = 'tab_'
+
+def script_name(db_name) -> str:
+    """Name of the script of a `data/<script>-db2.db` database."""
+    stem = Path(db_name).stem
+    return stem[:-len('-db2')] if stem.endswith('-db2') else stem
+
+def _columns(cursor: sqlite3.Cursor, table: str, schema: str='main') -> "list[str]":
+    return [row[1] for row in cursor.execute(f"pragma {schema}.table_info('{table}')")]
+
+def archive_setup(conn: sqlite3.Connection):
+    db_setup(conn, 'bulk')
+    db_verdict_codes(conn, [])
+    with closing(conn.cursor()) as cursor:
+        cursor.execute("CREATE TABLE IF NOT EXISTS runs(script, run, source, shots, archived, PRIMARY KEY(script, run))")
+        cursor.execute("CREATE TABLE IF NOT EXISTS rollup(script, run, dim, bin, bin_lo, bin_hi, verdict, count)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_rollup ON rollup(script, run, dim)")
+        conn.commit()
+
+def archive_rollup(conn: sqlite3.Connection, script: str, run: str, table: str, bins: int=20, schema: str='main'):
+    """
+    Store verdict counts per bin of every numeric column of `schema.table` in `rollup`.
+    Columns holding a single value get one bin.
+    """
+    with closing(conn.cursor()) as cursor:
+        verdict = db_verdict_sql(cursor, table, schema)
+        for dim in _columns(cursor, table, schema):
+            if dim in ('idx', 'verdict'):
+                continue
+            lo, hi, kind = cursor.execute(
+                f"SELECT min({dim}), max({dim}), typeof({dim}) FROM {schema}.'{table}'").fetchone()
+            if kind not in ('integer', 'real'):
+                continue
+            width = (hi - lo) / bins or 1
+            res = cursor.execute(
+                f"SELECT min(CAST(({dim} - ?) / ? AS INT), ?) AS bin, {verdict}, count() "
+                f"FROM {schema}.'{table}' WHERE {dim} IS NOT NULL GROUP BY bin, verdict",
+                (lo, width, bins - 1))
+            cursor.executemany(
+                "INSERT INTO rollup VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(script, run, dim, b, lo + b * width, lo + (b + 1) * width, verdict, count)
+                 for b, verdict, count in res.fetchall()])
+
+def archive_merge(conn: sqlite3.Connection, db_name: str, bins: int=20, drop: bool=False) -> "list[str]":
+    """Archive all runs of `db_name` that are not archived yet, returns their names."""
+    script = script_name(db_name)
+    arc_table = 'arc_' + re.sub(r'\W', '_', script)
+    archived = []
+    dropable = []
+
+    conn.execute("ATTACH DATABASE ? AS src", (str(db_name),))
+    try:
+        with closing(conn.cursor()) as cursor:
+            done = {run for run, in cursor.execute("SELECT run FROM runs WHERE script=?", (script,))}
+            tables = [name for name, in cursor.execute(
+                "SELECT name FROM src.sqlite_master WHERE type='table' AND name LIKE ? ORDER BY name",
+                (RUN_PREFIX + '%',))]
+
+            for run in tables:
+                if run in done:
+                    dropable.append(run)
+                    continue
+                cols = _columns(cursor, run, 'src')
+                if 'run' in cols:
+                    raise ValueError(f"{db_name}:{run} has a column named 'run', which the archive needs")
+
+                arc_cols = _columns(cursor, arc_table)
+                if not arc_cols:
+                    create_s = ', '.join(VERDICT_COLUMN if col == 'verdict' else col for col in cols)
+                    cursor.execute(f"CREATE TABLE '{arc_table}'(run, {create_s})")
+                else:
+                    for col in cols:
+                        if col not in arc_cols:
+                            cursor.execute(f"ALTER TABLE '{arc_table}' ADD COLUMN {col}")
+
+                # Sources may or may not have their verdicts dictionary encoded, the archive always has
+                verdict = db_verdict_sql(cursor, run, 'src')
+                db_verdict_codes(conn, [v for v, in cursor.execute(f"SELECT DISTINCT {verdict} FROM src.'{run}'")])
+                col_s = ', '.join(cols)
+                select_s = ', '.join(
+                    f"(SELECT code FROM main.verdicts WHERE verdict={verdict})" if col == 'verdict' else col
+                    for col in cols)
+                cursor.execute(f"INSERT INTO '{arc_table}'(run, {col_s}) SELECT ?, {select_s} FROM src.'{run}'", (run,))
+                shots = cursor.rowcount
+                archive_rollup(conn, script, run, run, bins=bins, schema='src')
+                cursor.execute("INSERT INTO runs VALUES (?, ?, ?, ?, ?)",
+                               (script, run, str(db_name), shots, datetime.datetime.now().isoformat()))
+                conn.commit()
+                print(f'{db_name}:{run} -> {arc_table}, {shots} shots')
+                archived.append(run)
+                dropable.append(run)
+    finally:
+        conn.execute("DETACH DATABASE src")
+
+    if archived:
+        db_create_indexes(conn, arc_table, ('run', 'verdict'))
+
+    if drop and dropable:
+        # The archive is written without syncs ('bulk'): get it on disk before the runs
+        # are dropped from the only other copy
+        conn.commit()
+        conn.execute('pragma synchronous=full')
+        busy, _, _ = db_checkpoint(conn, 'truncate')
+        conn.execute('pragma synchronous=off')
+        if busy:
+            raise RuntimeError(f'could not checkpoint the archive, not dropping the runs of {db_name}')
+        with closing(sqlite3.connect(db_name)) as src:
+            for run in dropable:
+                src.execute(f"DROP TABLE '{run}'")
+            src.commit()
+            src.execute('VACUUM')
+    return archived
+
+def archive_compact(archive_name: str, db_names: "list[str]", bins: int=20, drop: bool=False):
+    with closing(sqlite3.connect(archive_name)) as conn:
+        archive_setup(conn)
+        archived = [run for db_name in db_names for run in archive_merge(conn, db_name, bins=bins, drop=drop)]
+        if archived:
+            conn.execute('VACUUM')
+    return archived
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Merge run tables into an archive and build per-run rollups')
+    parser.add_argument('archive', help='archive database, created if it does not exist')
+    parser.add_argument('sources', nargs='+', help='databases with tab_* run tables')
+    parser.add_argument('--bins', type=int, default=20, help='bins per column for the rollups')
+    parser.add_argument('--drop', action='store_true', help='drop archived runs from the sources and VACUUM them')
+    args = parser.parse_args()
+
+    archived = archive_compact(args.archive, args.sources, bins=args.bins, drop=args.drop)
+    print(f'archived {len(archived)} runs into {args.archive}')
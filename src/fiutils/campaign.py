@@ -0,0 +1,218 @@
+from contextlib import closing
+import queue
+import sqlite3
+import threading
+from types import SimpleNamespace
+from typing import Callable, Iterable
+
+from .db import db_append_row, db_checkpoint, db_setup
+from .control import SKIP, STOP
+from .timing import ShotTimer
+from . import trace
+
+"""
+Campaign loop with the template's stages as callbacks.
+
+```
+def reset(p): ...
+def arm(p): ...
+def trigger(p): ...
+def classify(p): p.verdict = ...
+
+campaign = Campaign(db_name, table_name, {
+    'reset': reset,
+    'arm': arm,
+    'trigger': trigger,
+    'classify': classify,
+}, hist=hist, log=lambda row, hist: lm.info(pformat(row)))
+hist = campaign.run(progress)
+```
+
+The stages run in order on the calling thread, that is the hardware critical path.
+Everything that does not touch the target runs next to it on worker threads:
+
+- generating the next points: `points` (e.g. the `progress` from `setup_params`) is
+  iterated up to `prefetch` points ahead. When `points` is a tqdm bar, the points
+  come from what it wraps and the bar only counts the shots once they are stored
+  (and the skipped points), so it and the ETA do not run ahead of the database.
+- logging and storing the shots: rows are handed to a thread that calls `log` and
+  appends them to the database in batches of at most `batch` rows. When the campaign
+  ends, the WAL of the database is checkpointed and truncated.
+
+Every shot starts as a `SimpleNamespace` with `defaults`, the settings and `idx`.
+The duration of every stage is stored with the shot (`t_<stage>_ns`, see
+`fiutils.timing`), `campaign.timer.summary()` gives the percentiles. Pass a
+`fiutils.monitor.Monitor` to follow throughput and queue depths live, and a
+`fiutils.utils.Profiler` (see `setup_profiler`) to profile the first shots, and
+a `fiutils.control.Control` to pause, skip and stop between shots.
+A stage can set `p.stop = True` to end the campaign after that shot. Errors in a
+stage or a worker thread end the campaign as well, after the shots that were
+already done are stored.
+"""
+
+DEFAULTS = {
+    'verdict': 'NORMAL00',
+    'stop': False,
+}
+
+_END = object()
+
+def append_rows(db: sqlite3.Connection, table_name: str, rows: "list[dict]"):
+    # Rows go in one db_append_row call per run of rows with the same columns
+    start = 0
+    for i in range(1, len(rows) + 1):
+        if i == len(rows) or rows[i].keys() != rows[start].keys():
+            db_append_row(db, table_name, rows[start:i])
+            start = i
+
+class Campaign():
+    def __init__(self, db_name: str, table_name: str, stages: "dict[str, Callable]", hist: dict=None,
+                 log: Callable=None, defaults: dict=DEFAULTS, batch: int=100, prefetch: int=16,
+                 db_profile: str='safe', monitor=None, profiler=None, control=None) -> None:
+        self.db_name = db_name
+        self.table_name = table_name
+        self.stages = stages
+        self.hist = {} if hist is None else hist
+        self.log = log
+        self.defaults = defaults
+        self.batch = batch
+        self.db_profile = db_profile
+
+        self.timer = ShotTimer(*stages)
+        self.points = queue.Queue(maxsize=prefetch)
+        self.rows = queue.Queue()
+        self.monitor = monitor
+        self.profiler = profiler
+        self.control = control
+        if monitor is not None:
+            monitor.timer = monitor.timer or self.timer
+            monitor.queues.update(points=self.points, rows=self.rows)
+        self._done = threading.Event()
+        self._error = None
+        self._threads = []
+        self._progress = None
+
+    def _put(self, q: queue.Queue, item) -> bool:
+        # Put that gives up when the campaign is done, so a full queue cannot hang a worker
+        while not self._done.is_set():
+            try:
+                q.put(item, timeout=.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce(self, points: Iterable):
+        try:
+            for item in points:
+                if not self._put(self.points, item):
+                    return
+        except Exception as e:
+            self._error = e
+        self._put(self.points, _END)
+
+    def _write(self, db: sqlite3.Connection, rows: "list[dict]"):
+        append_rows(db, self.table_name, rows)
+
+    def _batches(self):
+        # Whatever is queued, at most `batch` (row, hist) items at a time, until the end
+        end = False
+        while not end:
+            items = [self.rows.get()]
+            while len(items) < self.batch:
+                try:
+                    items.append(self.rows.get_nowait())
+                except queue.Empty:
+                    break
+            if items[-1] is _END:
+                items.pop()
+                end = True
+            # Skipped points are (None, None), only for the progress bar
+            if self.log:
+                for row, hist in items:
+                    if row is not None:
+                        self.log(row, hist)
+            rows = [row for row, _ in items if row is not None]
+            if rows:
+                yield rows
+            # Back here once the sink asks for the next batch, that is when these are stored
+            if self._progress is not None and items:
+                self._progress.update(len(items))
+
+    def _sink(self):
+        try:
+            with closing(sqlite3.connect(self.db_name)) as db:
+                db_setup(db, self.db_profile)
+                for rows in self._batches():
+                    with self.timer.span('db_batch'):
+                        self._write(db, rows)
+                # SQLite checkpoints passively as it goes, which falls behind while notebooks
+                # read the database; leave an empty WAL behind
+                db_checkpoint(db, 'truncate')
+        except Exception as e:
+            self._error = e
+            self._done.set()
+
+    def shot(self, idx: int, settings: dict) -> SimpleNamespace:
+        p = SimpleNamespace(**self.defaults)
+        p.__dict__.update(settings)
+        p.idx = idx
+        shot = self.timer.shot(p)
+        for name, stage in self.stages.items():
+            with shot.span(name):
+                stage(p)
+        shot.done()
+        self.hist[p.verdict] = self.hist.get(p.verdict, 0) + 1
+        if self.monitor is not None:
+            self.monitor.shot(p.verdict)
+        if self.profiler is not None:
+            self.profiler.shot()
+        self.rows.put((p.__dict__, dict(self.hist)))
+        return p
+
+    def run(self, points: "Iterable[tuple[int, dict]]") -> dict:
+        """Run the stages for every `(idx, settings)` in `points`, returns the verdict histogram."""
+        # A tqdm bar is updated by the sink, the producer iterates what it wraps
+        if hasattr(points, 'iterable') and hasattr(points, 'update'):
+            self._progress = points
+        self._threads = [
+            threading.Thread(target=self._produce, args=(points.iterable if self._progress is not None else points,),
+                             name='campaign-points', daemon=True),
+            threading.Thread(target=self._sink, name='campaign-sink', daemon=True),
+        ]
+        for t in self._threads:
+            t.start()
+        try:
+            while not self._done.is_set():
+                try:
+                    item = self.points.get(timeout=.1)
+                except queue.Empty:
+                    continue
+                if item is _END:
+                    break
+                if self.control is not None:
+                    action = self.control.at_boundary(item[1])
+                    if action == SKIP:
+                        self.rows.put((None, None))
+                        continue
+                    elif action == STOP:
+                        break
+                with trace.span('shot', 'campaign'):
+                    p = self.shot(*item)
+                trace.counter('queues', {'points': self.points.qsize(), 'rows': self.rows.qsize()})
+                if p.stop:
+                    break
+        finally:
+            self.close(points)
+        if self._error:
+            raise self._error
+        return self.hist
+
+    def close(self, points=None):
+        # Store everything that is queued, then stop the workers
+        self.rows.put(_END)
+        self._threads[1].join()
+        self._done.set()
+        self._threads[0].join()
+        if hasattr(points, 'close'):
+            points.close()
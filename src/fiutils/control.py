@@ -0,0 +1,177 @@
+import argparse
+import atexit
+from pathlib import Path
+import signal
+import socket
+import sys
+import threading
+
+"""
+Pause, resume, skip and stop a running campaign, at shot boundaries only.
+
+```
+control = setup_control(__file__, timestamp, skip_keys=('xy_scanner0', 'xy_scanner1'))
+for idx, settings in progress:
+    action = control.at_boundary(settings)
+    if action == SKIP:
+        continue
+    elif action == STOP:
+        break
+    ...
+```
+
+Commands come from:
+- Ctrl-C: the first one pauses, a second one (while paused) stops. Ctrl-C no longer
+  raises KeyboardInterrupt in the middle of a shot or a db commit, only when a stop
+  was already requested (for a loop that hangs).
+- stdin: `p`ause, `r`esume, `s`kip, `q`uit (stop), followed by enter.
+- a UNIX socket at `logs/<script>/<timestamp>.sock` (where available), e.g.
+  `python -m fiutils.control logs/<script>/<timestamp>.sock pause`.
+
+`skip` drops the following points until one of `skip_keys` changes value, e.g. to
+move on to the next xy position. Nothing is polled: `at_boundary` returns
+immediately unless a command is pending, and pausing blocks the loop thread
+(the campaign's db writer keeps flushing in the meantime).
+"""
+
+SKIP = 'skip'
+STOP = 'stop'
+
+COMMANDS = {
+    'p': 'pause',
+    'r': 'resume',
+    's': 'skip',
+    'q': 'stop',
+}
+
+class Control():
+    def __init__(self, skip_keys: "tuple[str]"=None) -> None:
+        self.skip_keys = skip_keys
+        self.pending = False
+        self.paused = False
+        self.stopping = False
+        self._skip = False
+        self._skip_values = None
+        self._resume = threading.Event()
+        self._resume.set()
+        # Reentrant: Ctrl-C runs `_sigint` on the main thread, which may be holding it in
+        # `at_boundary`
+        self._lock = threading.RLock()
+
+    def command(self, cmd: str) -> str:
+        with self._lock:
+            return self._command(COMMANDS.get(cmd, cmd))
+
+    def _command(self, cmd: str) -> str:
+        if cmd == 'pause':
+            self.paused = True
+            self._resume.clear()
+        elif cmd == 'resume':
+            self.paused = False
+            self._resume.set()
+        elif cmd == 'skip':
+            if not self.skip_keys:
+                return 'skip needs skip_keys'
+            self._skip = True
+            # Skipping from the pause prompt carries on with the next point
+            self.paused = False
+            self._resume.set()
+        elif cmd == 'stop':
+            self.stopping = True
+            self._resume.set()
+        elif cmd != 'status':
+            return f'unknown {cmd=}, use one of {list(COMMANDS.values()) + ["status"]}'
+        self.pending = self.paused or self.stopping or self._skip or self._skip_values is not None
+        return self.status()
+
+    def status(self) -> str:
+        state = 'stopping' if self.stopping else 'paused' if self.paused else 'running'
+        return state + (' (skipping)' if self._skip or self._skip_values is not None else '')
+
+    def at_boundary(self, settings: dict) -> "str | None":
+        """Call before every shot, returns `SKIP` (drop this point), `STOP` or None."""
+        if not self.pending:
+            return None
+        if self.paused:
+            sys.stderr.write('\nPaused: [r]esume/[s]kip/[q]uit\n')
+            # Timed waits, an untimed one cannot be interrupted by Ctrl-C on Windows
+            while not self._resume.wait(.2):
+                if self.stopping:
+                    break
+        if self.stopping:
+            return STOP
+
+        if self._skip:
+            self._skip = False
+            self._skip_values = tuple(settings[k] for k in self.skip_keys)
+        if self._skip_values is not None:
+            if tuple(settings[k] for k in self.skip_keys) == self._skip_values:
+                return SKIP
+            self._skip_values = None
+        with self._lock:
+            # Cleared before the flags are read: a Ctrl-C in between sets them first
+            # and `pending` after, so it is never lost
+            self.pending = False
+            if self.paused or self.stopping or self._skip:
+                self.pending = True
+        return None
+
+    def _sigint(self, signum, frame):
+        with self._lock:
+            if self.stopping:
+                raise KeyboardInterrupt
+            self._command('stop' if self.paused else 'pause')
+
+    def install_signals(self):
+        # Signal handlers can only be installed from the main thread
+        signal.signal(signal.SIGINT, self._sigint)
+
+    def _read_stdin(self):
+        for line in sys.stdin:
+            if line.strip():
+                sys.stderr.write(self.command(line.strip()) + '\n')
+
+    def listen_stdin(self):
+        threading.Thread(target=self._read_stdin, name='control-stdin', daemon=True).start()
+
+    def _serve(self, server: socket.socket):
+        while True:
+            conn, _ = server.accept()
+            with conn:
+                cmd = conn.recv(64).decode().strip()
+                conn.sendall(self.command(cmd).encode() + b'\n')
+
+    def listen_socket(self, path) -> bool:
+        if not hasattr(socket, 'AF_UNIX'):
+            return False
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if path.exists():
+            path.unlink()
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(str(path))
+        server.listen()
+        atexit.register(lambda: path.exists() and path.unlink())
+        threading.Thread(target=self._serve, args=(server,), name='control-socket', daemon=True).start()
+        return True
+
+def setup_control(fname, timestamp, skip_keys: "tuple[str]"=None, stdin: bool=True) -> Control:
+    control = Control(skip_keys)
+    control.install_signals()
+    if stdin:
+        control.listen_stdin()
+    control.listen_socket(Path('logs') / f'{fname}' / f'{timestamp}.sock')
+    return control
+
+def send(path, cmd: str) -> str:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(str(path))
+        client.sendall(cmd.encode())
+        return client.recv(1024).decode().strip()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Control a running campaign')
+    parser.add_argument('socket', help='logs/<script>/<timestamp>.sock')
+    parser.add_argument('command', choices=list(COMMANDS.values()) + ['status'])
+    args = parser.parse_args()
+    print(send(args.socket, args.command))
@@ -1,16 +1,128 @@
-from contextlib import closing
+from contextlib import closing, contextmanager
+import os
+from pathlib import Path
 import sqlite3
+import sys
+import time
+from typing import Iterable
 
-import numpy as np
+from .trace import traced
 
-def db_setup(conn: sqlite3.Connection):
-    conn.execute('pragma journal_mode=wal')
+# Columns that get an index when a run table is created
+DB_INDEXES = ('verdict',)
+
+# Ingest profiles for `db_setup`. Pragmas are applied in order (`page_size` only has
+# effect on a fresh database, so it goes before `journal_mode`). `defer_index` means
+# the caller creates the indexes with `db_create_indexes` once the load is done.
+DB_PROFILES = {
+    # Survives power loss of the host, every commit hits the disk
+    'safe': {
+        'pragmas': {
+            'journal_mode': 'wal',
+            'synchronous': 'full',
+            'journal_size_limit': 64 * 1024**2,
+        },
+        'defer_index': False,
+    },
+    # Survives a crash of the script, may lose the last commits on power loss of the host
+    'fast': {
+        'pragmas': {
+            'journal_mode': 'wal',
+            'synchronous': 'normal',
+            'mmap_size': 256 * 1024**2,
+            'cache_size': -64 * 1024,
+            'temp_store': 'memory',
+            'journal_size_limit': 64 * 1024**2,
+        },
+        'defer_index': False,
+    },
+    # For (re)loading data that exists elsewhere, e.g. converting a shot log or building an archive
+    'bulk': {
+        'pragmas': {
+            'page_size': 65536,
+            'journal_mode': 'wal',
+            'synchronous': 'off',
+            'mmap_size': 1024**3,
+            'cache_size': -256 * 1024,
+            'temp_store': 'memory',
+        },
+        'defer_index': True,
+    },
+}
+
+def db_setup(conn: sqlite3.Connection, profile: str='safe') -> dict:
+    """
+    Apply an ingest profile from `DB_PROFILES` and register the numpy adapters.
+    Returns the profile, pass `profile['defer_index']` on to `db_append_row`.
+    """
+    try:
+        settings = DB_PROFILES[profile]
+    except KeyError:
+        raise ValueError(f'unknown {profile=}, pick one of {list(DB_PROFILES)}')
+    for pragma, value in settings['pragmas'].items():
+        conn.execute(f'pragma {pragma}={value}')
+    # Only here, so importing the db layer does not import numpy
+    import numpy as np
     sqlite3.register_adapter(np.int32, int)
     sqlite3.register_adapter(np.int64, int)
     sqlite3.register_adapter(np.float32, float)
     sqlite3.register_adapter(np.float64, float)
+    return settings
+
+def _create_indexes(cursor: sqlite3.Cursor, table: str, columns: "tuple[str]"):
+    for col in columns:
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS 'idx_{table}_{col}' ON '{table}'({col})")
+
+def db_create_indexes(conn: sqlite3.Connection, table: str, columns: "tuple[str]"=DB_INDEXES):
+    # For use after a load with `defer_index=True`, columns the table does not have are skipped
+    with closing(conn.cursor()) as cursor:
+        existing = [row[1] for row in cursor.execute(f"pragma table_info('{table}')")]
+        _create_indexes(cursor, table, [col for col in columns if col in existing])
+        cursor.connection.commit()
+
+# Verdicts are stored as codes into the `verdicts` table, which maps them back to
+# the strings. Codes are handed out in order starting at 0, so they can be used
+# directly as the codes of a pandas Categorical (see `db_verdicts`).
+VERDICT_COLUMN = 'verdict INTEGER REFERENCES verdicts(code)'
+VERDICT_ENCODE = '(SELECT code FROM verdicts WHERE verdict=:verdict)'
+
+def _create_verdicts(cursor: sqlite3.Cursor):
+    cursor.execute("CREATE TABLE IF NOT EXISTS verdicts(code INTEGER PRIMARY KEY, verdict TEXT UNIQUE)")
+
+def _add_verdicts(cursor: sqlite3.Cursor, verdicts: "Iterable[str]"):
+    cursor.executemany("INSERT OR IGNORE INTO verdicts SELECT count(), ? FROM verdicts", [(v,) for v in verdicts])
+
+def db_verdicts(conn: sqlite3.Connection) -> "list[str]":
+    # Verdict strings, indexed by code
+    with closing(conn.cursor()) as cursor:
+        res = cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='verdicts'")
+        if not res.fetchone():
+            return []
+        return [v for v, in cursor.execute("SELECT verdict FROM verdicts ORDER BY code")]
 
-def db_append_row(conn: sqlite3.Connection, table: str, data: "list[dict]"):
+def db_verdict_codes(conn: sqlite3.Connection, verdicts: "Iterable[str]") -> "dict[str, int]":
+    # Codes of `verdicts`, adding the ones that are not known yet
+    with closing(conn.cursor()) as cursor:
+        _create_verdicts(cursor)
+        _add_verdicts(cursor, verdicts)
+        return dict(cursor.execute("SELECT verdict, code FROM verdicts"))
+
+def db_verdict_sql(cursor: sqlite3.Cursor, table: str, schema: str='main') -> str:
+    """
+    SQL expression for the verdict string of a row of `schema.table`, for both
+    dictionary encoded tables and tables that hold the strings.
+    """
+    sql, = cursor.execute(f"SELECT sql FROM {schema}.sqlite_master WHERE type='table' AND name=?", (table,)).fetchone()
+    if VERDICT_COLUMN in sql:
+        return f"(SELECT v.verdict FROM {schema}.verdicts v WHERE v.code={schema}.'{table}'.verdict)"
+    return f"{schema}.'{table}'.verdict"
+
+# Columns of the run tables by (name, CREATE statement), which SQLite rewrites with
+# every added column, so `db_append_row` only asks for them when a table changed
+_TABLE_COLUMNS = {}
+
+@traced('db')
+def db_append_row(conn: sqlite3.Connection, table: str, data: "list[dict]", defer_index: bool=False):
     with closing(conn.cursor()) as cursor:
         if isinstance(data, dict):
             f_insert = cursor.execute
@@ -24,7 +136,8 @@ def db_append_row(conn: sqlite3.Connection, table: str, data: "list[dict]"):
             raise TypeError(f'data must be dict or list of dicts, not {type(data)=}')
             
         res = cursor.execute(f"SELECT * FROM sqlite_master WHERE type='table' AND name=?", (table,))
-        if not res.fetchone():
+        row = res.fetchone()
+        if not row:
             print(f'{table} does not exist yet, creating it')
 
             # if isinstance(data, dict):
@@ -35,18 +148,39 @@ def db_append_row(conn: sqlite3.Connection, table: str, data: "list[dict]"):
             #     raise TypeError
             # create_s = ', '.join(f'{k} {t}' for k,t in zip(keys, types))
 
-            create_s = ', '.join(keys)
+            create_s = ', '.join(VERDICT_COLUMN if k == 'verdict' else k for k in keys)
 
+            _create_verdicts(cursor)
             cursor.execute(f"CREATE TABLE '{table}'({create_s})")
+            if not defer_index:
+                _create_indexes(cursor, table, [col for col in DB_INDEXES if col in keys])
+            encoded = 'verdict' in keys
         else:
-            pass
+            # Tables from before the verdict dictionary hold the strings
+            encoded = VERDICT_COLUMN in row[4]
+            # A resumed run can store columns its table does not have yet (e.g. the
+            # t_<stage>_ns of fiutils.timing), they are NULL for the older rows and
+            # columns the rows do not have anymore are NULL for the new ones
+            columns = _TABLE_COLUMNS.get((table, row[4]))
+            if columns is None:
+                columns = {info[1] for info in cursor.execute(f"pragma table_info('{table}')")}
+                _TABLE_COLUMNS[table, row[4]] = columns
+            for col in keys:
+                if col not in columns:
+                    cursor.execute(f"ALTER TABLE '{table}' ADD COLUMN {col}")
 
+        col_s = ','.join(keys)
+        values = ','.join(VERDICT_ENCODE if encoded and col == 'verdict' else f':{col}' for col in keys)
         while True:
             try:
-                f_insert(f"INSERT INTO '{table}' VALUES ({ ','.join(f':{col}' for col in keys) })", data)
+                if encoded:
+                    _add_verdicts(cursor, [data['verdict']] if isinstance(data, dict) else {d['verdict'] for d in data})
+                f_insert(f"INSERT INTO '{table}'({col_s}) VALUES ({values})", data)
             except sqlite3.OperationalError as e:
                 if str(e) == 'database is locked':
-                    sys.stderr.write('Database is locked, trying again in 1 second')
+                    sys.stderr.write('Database is locked, trying again in 1 second\n')
+                    time.sleep(1)
+                    continue
                 else:
                     raise e
             break
@@ -61,8 +195,54 @@ def db_get_hist(conn: sqlite3.Connection, table: str) -> dict:
         if not res.fetchone():
             print(f'{table} does not exist yet')
         else:
-            res = cursor.execute(f"SELECT verdict,count() FROM '{table}' GROUP BY verdict")
+            res = cursor.execute(f"SELECT {db_verdict_sql(cursor, table)},count() FROM '{table}' GROUP BY verdict")
             for k,v in res.fetchall():
                 hist[k] = v
     return hist
 
+
+# Reading while a campaign is writing. In WAL mode readers do not block the writer,
+# but a checkpoint cannot move past the oldest open read transaction, so the WAL
+# keeps growing while a long scan runs. Keep read transactions short, or work on
+# a copy made with `db_backup_copy`.
+
+def db_connect_ro(db_name: str) -> sqlite3.Connection:
+    return sqlite3.connect(f'{Path(db_name).resolve().as_uri()}?mode=ro', uri=True)
+
+@contextmanager
+def db_snapshot(db_name: str):
+    """
+    Read-only connection inside a single read transaction, so all queries see the
+    same state of the database, e.g. `pd.read_sql_query(..., conn)` for the table
+    and then for its histogram.
+    """
+    with closing(db_connect_ro(db_name)) as conn:
+        conn.execute('BEGIN')
+        try:
+            yield conn
+        finally:
+            conn.rollback()
+
+def db_checkpoint(conn: sqlite3.Connection, mode: str='passive') -> "tuple[int, int, int]":
+    # Returns (busy, wal pages, checkpointed pages). `passive` never waits on readers.
+    return conn.execute(f'pragma wal_checkpoint({mode})').fetchone()
+
+def db_backup_copy(db_name: str, dst: str=None, max_age_s: float=None) -> Path:
+    """
+    Copy `db_name` to `dst` (default `<db_name>.snapshot`) with the online backup
+    API and return its path. The source is only read for as long as the copy takes.
+    With `max_age_s`, an existing copy younger than that is reused, so a notebook
+    cell can call this every time it runs.
+    """
+    dst = Path(dst) if dst else Path(f'{db_name}.snapshot')
+    if max_age_s is not None and dst.exists() and time.time() - dst.stat().st_mtime < max_age_s:
+        return dst
+
+    # Copy to a temporary file first, so readers of `dst` never see a half copy
+    tmp = dst.with_name(f'{dst.name}.tmp')
+    with closing(db_connect_ro(db_name)) as src, closing(sqlite3.connect(tmp)) as conn:
+        src.backup(conn)
+        # Single file, no -wal/-shm to carry around
+        conn.execute('pragma journal_mode=delete')
+    os.replace(tmp, dst)
+    return dst
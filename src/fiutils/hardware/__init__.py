@@ -1,44 +1,63 @@
-from serial.tools import list_ports
+from typing import TYPE_CHECKING
 
-from .chronology import Chronology
-from .spider import Spider
+if TYPE_CHECKING:
+    from .chronology import Chronology
+    from .spider import Spider
+
+# Chronology and Spider (and with them pyserial) are only imported when they are used,
+# so scripts that only need e.g. the port finders start quickly
+def __getattr__(name):
+    if name == 'Chronology':
+        from .chronology import Chronology
+        return Chronology
+    elif name == 'Spider':
+        from .spider import Spider
+        return Spider
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+def _comports(exclude=()):
+    # `exclude` holds devices or USB serial numbers that are already taken, e.g. by another bench
+    from serial.tools import list_ports
+    return [port for port in list_ports.comports()
+            if port.device not in exclude and port.serial_number not in exclude]
 
 def port_info():
-    for port in list_ports.comports():
+    for port in _comports():
         print(f'{port.device=}, {port.description=}, {port.name=}, {port.manufacturer=}, {port.usb_info()=}')
 
-def find_upython():
-    for port in list_ports.comports():
+def find_upython(exclude=()):
+    for port in _comports(exclude):
         if port.manufacturer == 'MicroPython':
             return port.device
     return None
 
-def find_spider():
+def find_spider(exclude=()):
     # NOTE: it exposes two com ports, assuming the first hit in the list is what we want always
-    for port in list_ports.comports():
+    for port in _comports(exclude):
         if port.description == 'Spider - Spider' or 'Test Tool 1.x' in port.description:
             return port.device
     return None
 
-def find_stlink_uart():
-    for port in list_ports.comports():
+def find_stlink_uart(exclude=()):
+    for port in _comports(exclude):
         if port.description == 'STM32 STLink - ST-Link VCP Ctrl':
             return port.device
     return None
 
-def find_3018():
-    for port in list_ports.comports():
+def find_3018(exclude=()):
+    for port in _comports(exclude):
         if '1A86:7523' in port.usb_info():
             return port.device
     return None
 
-def find_chipshouter():
-    for port in list_ports.comports():
+def find_chipshouter(exclude=()):
+    for port in _comports(exclude):
         if 'ChipSHOUTER' in port.description:
             return port.device
     return None    
 
-def arm_spider_glitch(glitcher: Chronology, glitch_v, glitch_delay_s, glitch_time_s, do_glitch=True):
+def arm_spider_glitch(glitcher: 'Chronology', glitch_v, glitch_delay_s, glitch_time_s, do_glitch=True):
+    from .spider import Spider
     glitcher.forget_events()
     # glitcher.set_gpio_now(0, 0)
     glitcher.wait_trigger(8, Spider.RISING_EDGE, 1)
@@ -53,10 +72,11 @@ def arm_spider_glitch(glitcher: Chronology, glitch_v, glitch_delay_s, glitch_tim
     # glitcher.set_gpio(0, 0)
     glitcher.start()
 
-def arm_spider_glitch2(glitcher: Chronology, 
+def arm_spider_glitch2(glitcher: 'Chronology', 
                       glitch_v, glitch_delay_s, glitch_time_s, 
                       glitch_v2, glitch_delay_s2, glitch_time_s2, 
                       do_glitch=True):
+    from .spider import Spider
     glitcher.forget_events()
     # glitcher.set_gpio_now(0, 0)
     glitcher.wait_trigger(8, Spider.RISING_EDGE, 1)
@@ -4,7 +4,10 @@ from typing import List
 
 import serial
 
+from ..trace import traced
 
+
+@traced('spider')
 class Spider:
     _VERSION = 1.0
 
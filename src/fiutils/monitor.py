@@ -0,0 +1,100 @@
+from collections import Counter, deque
+import json
+from pathlib import Path
+import threading
+import time
+
+"""
+Live throughput of a campaign: shots/s, verdict rates and latencies over the last
+`window_s` seconds, and queue depths.
+
+```
+monitor = setup_monitor(__file__, timestamp, progress=progress, timer=timer)
+for idx, settings in progress:
+    ...
+    monitor.shot(p.verdict)
+monitor.stop()
+```
+
+Recording a shot is an append to a deque, all the work is done by a thread that
+wakes up every `refresh_s` seconds. It puts a short summary on the `progress` bar
+(if any) and appends a JSON line with everything to `logs/<script>/<timestamp>.stats.jsonl`,
+e.g. to follow with `tail -f` or to feed a dashboard.
+"""
+
+class Monitor():
+    def __init__(self, stats_file=None, progress=None, timer=None, queues: dict=None,
+                 window_s: float=10, refresh_s: float=2) -> None:
+        self.stats_file = Path(stats_file) if stats_file else None
+        self.progress = progress
+        self.timer = timer
+        self.queues = queues or {}
+        self.window_s = window_s
+        self.refresh_s = refresh_s
+
+        self.shots = 0
+        self.t_start = time.monotonic()
+        self._window = deque()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def shot(self, verdict):
+        self.shots += 1
+        self._window.append((time.monotonic(), verdict))
+
+    def snapshot(self) -> dict:
+        now = time.monotonic()
+        while self._window and self._window[0][0] < now - self.window_s:
+            self._window.popleft()
+        events = list(self._window)
+        span = min(self.window_s, now - self.t_start) or 1
+        counts = Counter(verdict for _, verdict in events)
+        return {
+            'time': time.time(),
+            'shots': self.shots,
+            'shots_per_s': len(events) / span,
+            'window_s': self.window_s,
+            'verdicts': {str(v): n / len(events) for v, n in counts.items()},
+            'latency_us': {name: [t / 1e3 for t in ts] for name, ts in self.timer.percentiles().items()} if self.timer else {},
+            'queues': {name: q.qsize() for name, q in self.queues.items()},
+        }
+
+    def summary(self, stats: dict=None) -> str:
+        stats = stats or self.snapshot()
+        s = f'{stats["shots_per_s"]:.0f}/s'
+        s += ''.join(f' {v[:3]} {rate * 100:.1f}%' for v, rate in sorted(stats['verdicts'].items()))
+        if 'shot' in stats['latency_us']:
+            s += f' p99 {stats["latency_us"]["shot"][-1] / 1e3:.1f}ms'
+        if stats['queues']:
+            s += ' q' + '/'.join(str(n) for n in stats['queues'].values())
+        return s
+
+    def _run(self):
+        while not self._stop.wait(self.refresh_s):
+            self.refresh()
+
+    def refresh(self):
+        stats = self.snapshot()
+        if self.progress is not None:
+            self.progress.set_postfix_str(self.summary(stats))
+        if self.stats_file:
+            with open(self.stats_file, 'a') as f:
+                f.write(json.dumps(stats) + '\n')
+
+    def start(self):
+        if self.stats_file:
+            self.stats_file.parent.mkdir(parents=True, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name='monitor', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+            self.refresh()
+
+def setup_monitor(fname, timestamp, **kwargs) -> Monitor:
+    # Start a monitor that writes its stats next to the log file of the run
+    return Monitor(Path('logs') / f'{fname}' / f'{timestamp}.stats.jsonl', **kwargs).start()
@@ -21,6 +21,9 @@
 import socket
 import pprint
 
+from ..trace import traced
+
+@traced('openocd')
 class OpenOcd:
     COMMAND_TOKEN = '\x1a'
 
@@ -0,0 +1,361 @@
+from collections import deque
+from contextlib import closing
+from itertools import islice
+import logging
+from logging.handlers import QueueListener
+import multiprocessing as mp
+from pathlib import Path
+import queue
+import signal
+import sqlite3
+import traceback
+from typing import Callable
+
+import numpy as np
+
+from .campaign import DEFAULTS, Campaign, append_rows
+from .control import STOP
+from .db import db_setup
+from .params import pproduct, ptotal
+
+"""
+Several bench stations from one host: a `Campaign` per bench, each in its own
+process, on shards of the same parameter product, into one table.
+
+```
+def setup(bench):
+    # Runs in the bench's process, opens its devices and returns its stages
+    glitcher = Chronology(bench['spider'])
+    def arm(p): ...
+    return {'reset': reset, 'arm': arm, 'trigger': trigger, 'classify': classify}
+
+benches = find_benches({'spider': find_spider, 'target': find_stlink_uart})
+orchestrator = Orchestrator(db_name, table_name, setup, benches, params,
+                            hist=hist, progress=progress, monitor=setup_monitor(...))
+hist = orchestrator.run()
+```
+
+- The orchestrator (the calling process) hands out shards of `shard_size`
+  consecutive points of `pproduct(params)`, one at a time, to benches that are ready.
+- Every bench runs a `Campaign` on its shard, its rows (with a `bench` column) go
+  to a single writer process that owns the database.
+- The writer reports what is stored, that is where the combined histogram,
+  `progress` and `monitor` (combined throughput) are updated.
+- A bench that fails (an exception in `setup` or a stage, or a crash of its process)
+  is retired, the part of its shard that is not stored yet is requeued for the other
+  benches. A shard is given up on after `max_attempts` failures.
+- A stage setting `p.stop = True`, or Ctrl-C, stops all benches between shots.
+  A second Ctrl-C interrupts.
+
+Benches are forked so that `setup` can be a closure in the script and the workers
+log through the handlers of the script. This needs the 'fork' start method (Linux,
+macOS), `run` raises without it. The benches are forked from a process that already
+runs threads (the log listeners, `monitor`, tqdm's monitor thread) and only the
+forking thread exists in a bench: `setup` and the stages must not depend on those
+threads or on locks they could hold, log through `logging` (which is handled here)
+and leave `progress` to the orchestrator.
+
+Since shards finish out of order, resuming a run with `get_resume_idx` is not
+reliable: with `resume=True` the orchestrator runs the ranges of `idx` that are
+missing from the table instead (`start` is then ignored).
+"""
+
+def find_benches(finders: "dict[str, Callable]", n: int=None) -> "list[dict[str, str]]":
+    """
+    Ports of up to `n` complete benches, e.g. `{'spider': find_spider, 'target': find_stlink_uart}`,
+    using the `fiutils.hardware` finders. Every port (and USB device) goes to one bench only.
+    """
+    from .hardware import _comports
+    serials = {port.device: port.serial_number for port in _comports()}
+    used = set()
+    benches = []
+    while n is None or len(benches) < n:
+        bench = {}
+        for name, finder in finders.items():
+            device = finder(exclude=used)
+            if device is None:
+                return benches
+            bench[name] = device
+            used.add(device)
+            if serials.get(device):
+                used.add(serials[device])
+        benches.append(bench)
+    return benches
+
+def _missing(db_name: str, table_name: str, total: int) -> "tuple[list[tuple[int, int]], int]":
+    # The [start, end) ranges of idx below `total` that are not in the table yet, and the rows that are
+    if not Path(db_name).exists():
+        return [(0, total)], 0
+    with closing(sqlite3.connect(db_name)) as db:
+        if not db.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (table_name,)).fetchone():
+            return [(0, total)], 0
+        gaps = db.execute(f"SELECT prev + 1, idx FROM (SELECT idx, lag(idx, 1, -1) OVER (ORDER BY idx) AS prev "
+                          f"FROM '{table_name}') WHERE idx > prev + 1").fetchall()
+        last, stored = db.execute(f"SELECT max(idx), count() FROM '{table_name}'").fetchone()
+    last = -1 if last is None else last
+    return [tuple(gap) for gap in gaps] + ([(last + 1, total)] if last + 1 < total else []), stored
+
+class _StopFlag():
+    # Stops the campaign of a bench between shots, when the orchestrator says so
+    def __init__(self, event) -> None:
+        self.event = event
+
+    def at_boundary(self, settings: dict):
+        return STOP if self.event.is_set() else None
+
+class _BenchCampaign(Campaign):
+    # Campaign that hands its rows to the writer process instead of storing them
+    def __init__(self, bench_id: int, out, *args, **kwargs) -> None:
+        super().__init__(None, None, *args, **kwargs)
+        self.bench_id = bench_id
+        self.out = out
+        self.stopped = False
+
+    def _sink(self):
+        try:
+            for rows in self._batches():
+                self.stopped |= any(row['stop'] for row in rows)
+                self.out.put(('rows', self.bench_id, rows))
+        except Exception as e:
+            self._error = e
+            self._done.set()
+
+def _bench(bench_id, bench, setup, params, inbox, rows, events, stop, log_queues, campaign_kwargs):
+    # Ctrl-C in the terminal reaches all processes, only the orchestrator acts on it
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for handler, log_queue in log_queues:
+        handler.queue = log_queue
+    # Forked benches would draw the same random parameters
+    np.random.seed()
+    try:
+        stages = setup(bench)
+        events.put(('ready', bench_id, None))
+        while (shard := inbox.get()) is not None:
+            start, end = shard
+            # Parameters are iterators, the previous shard left them halfway
+            for param in params:
+                param.reset()
+            campaign = _BenchCampaign(bench_id, rows, stages, defaults={**DEFAULTS, 'bench': bench_id},
+                                      control=_StopFlag(stop), **campaign_kwargs)
+            campaign.run(islice(enumerate(pproduct(params, start), start), end - start))
+            if campaign.stopped:
+                events.put(('stop', bench_id, None))
+            events.put(('ready', bench_id, None))
+    except Exception:
+        events.put(('error', bench_id, traceback.format_exc()))
+        raise SystemExit(1)
+
+def _writer(db_name, table_name, db_profile, rows, events):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    last = {}
+    retired = set()
+    try:
+        with closing(sqlite3.connect(db_name)) as db:
+            db_setup(db, db_profile)
+            while (item := rows.get()) is not None:
+                kind, bench_id, data = item
+                if kind == 'retire':
+                    # Everything the bench sent is in the queue before this, since its process ended
+                    retired.add(bench_id)
+                    events.put(('retired', bench_id, last.get(bench_id)))
+                elif bench_id not in retired:
+                    append_rows(db, table_name, data)
+                    last[bench_id] = data[-1]['idx']
+                    verdicts = {}
+                    for row in data:
+                        verdicts[row['verdict']] = verdicts.get(row['verdict'], 0) + 1
+                    events.put(('stored', bench_id, verdicts))
+    except Exception:
+        events.put(('error', None, traceback.format_exc()))
+        raise SystemExit(1)
+
+def _log_queues(ctx) -> "tuple[list, list[QueueListener]]":
+    # Listener threads do not survive a fork: the `fiutils.utils` queue handlers of
+    # the benches get a process queue, read by a listener here with the same handlers
+    loggers = [logging.getLogger()] + [logger for logger in logging.Logger.manager.loggerDict.values()
+                                       if isinstance(logger, logging.Logger)]
+    log_queues, listeners = [], []
+    for logger in loggers:
+        for handler in logger.handlers:
+            if getattr(handler, 'listener', None) is not None:
+                log_queue = ctx.Queue()
+                listener = QueueListener(log_queue, *handler.listener.handlers, respect_handler_level=True)
+                listener.start()
+                log_queues.append((handler, log_queue))
+                listeners.append(listener)
+    return log_queues, listeners
+
+class Orchestrator():
+    def __init__(self, db_name: str, table_name: str, setup: Callable, benches: "list[dict]", params: list,
+                 shard_size: int=10_000, start: int=0, hist: dict=None, progress=None, monitor=None,
+                 max_attempts: int=3, db_profile: str='safe', resume: bool=False, **campaign_kwargs) -> None:
+        self.db_name = db_name
+        self.table_name = table_name
+        self.setup = setup
+        self.benches = benches
+        self.params = params
+        self.shard_size = shard_size
+        self.hist = {} if hist is None else hist
+        self.progress = progress
+        self.monitor = monitor
+        self.max_attempts = max_attempts
+        self.db_profile = db_profile
+        self.campaign_kwargs = campaign_kwargs
+
+        self.total = ptotal(params)
+        self.shots = [0] * len(benches)
+        self.failed = []
+        self._next = start
+        self._requeued = deque()
+        if resume:
+            # The gaps left by shards that did not finish, in shards, then the rest
+            missing, stored = _missing(db_name, table_name, self.total)
+            for gap_start, gap_end in missing[:-1] if missing and missing[-1][1] == self.total else missing:
+                for shard_start in range(gap_start, gap_end, shard_size):
+                    self._requeued.append([shard_start, min(shard_start + shard_size, gap_end), 0])
+            self._next = missing[-1][0] if missing and missing[-1][1] == self.total else self.total
+            if progress is not None:
+                progress.n = stored
+                progress.refresh()
+
+    def _shard(self) -> "list[int] | None":
+        # [start, end, failures] of the next shard to run
+        if self._stop.is_set():
+            return None
+        if self._requeued:
+            return self._requeued.popleft()
+        if self._next < self.total:
+            shard = [self._next, min(self._next + self.shard_size, self.total), 0]
+            self._next = shard[1]
+            return shard
+        return None
+
+    def _requeue(self, bench_id: int, last: "int | None"):
+        shard = self._inflight.pop(bench_id)
+        # The last row of the bench is from an earlier shard when none of this one got stored
+        if last is not None and shard[0] <= last < shard[1]:
+            shard[0] = last + 1
+        shard[2] += 1
+        if shard[0] >= shard[1]:
+            return
+        if shard[2] >= self.max_attempts:
+            print(f'giving up on idx {shard[0]}..{shard[1] - 1} after {shard[2]} failures')
+            return
+        print(f'requeued idx {shard[0]}..{shard[1] - 1} of bench{bench_id}')
+        self._requeued.append(shard)
+
+    def _dispatch(self):
+        # Shards to idle benches, once nothing can come back anymore they are sent home
+        while self._idle:
+            shard = self._shard()
+            if shard is None:
+                break
+            bench_id = self._idle.popleft()
+            self._inflight[bench_id] = shard
+            self._inboxes[bench_id].put(tuple(shard[:2]))
+        if not self._inflight and not self._retiring:
+            while self._idle:
+                self._inboxes[self._idle.popleft()].put(None)
+
+    def _event(self, kind: str, bench_id: int, data):
+        if kind == 'stored':
+            for verdict, n in data.items():
+                self.hist[verdict] = self.hist.get(verdict, 0) + n
+                if self.monitor is not None:
+                    for _ in range(n):
+                        self.monitor.shot(verdict)
+            n = sum(data.values())
+            self.shots[bench_id] += n
+            if self.progress is not None:
+                self.progress.update(n)
+        elif kind == 'ready':
+            self._inflight.pop(bench_id, None)
+            self._idle.append(bench_id)
+        elif kind == 'stop':
+            self._stop.set()
+        elif kind == 'retired':
+            self._retiring.discard(bench_id)
+            if bench_id in self._inflight:
+                self._requeue(bench_id, data)
+        elif kind == 'error':
+            print(f'{"writer" if bench_id is None else f"bench{bench_id} {self.benches[bench_id]}"} failed:\n{data}')
+
+    def run(self) -> dict:
+        """Run all shards on the benches, returns the combined verdict histogram."""
+        if 'fork' not in mp.get_all_start_methods():
+            # `setup` is a closure and the log handlers have listener threads, neither
+            # pickles, and a spawned bench would run the whole script again
+            raise RuntimeError("Orchestrator forks its benches, the 'fork' start method is not available here")
+        ctx = mp.get_context('fork')
+        self._stop = ctx.Event()
+        self._events = ctx.Queue()
+        self._rows = ctx.Queue()
+        self._inboxes = [ctx.Queue() for _ in self.benches]
+        self._inflight = {}
+        self._retiring = set()
+        self._idle = deque()
+        log_queues, listeners = _log_queues(ctx)
+
+        writer = ctx.Process(target=_writer, name='fiutils-writer', daemon=True,
+                             args=(self.db_name, self.table_name, self.db_profile, self._rows, self._events))
+        workers = {
+            bench_id: ctx.Process(target=_bench, name=f'bench{bench_id}', daemon=True,
+                                  args=(bench_id, bench, self.setup, self.params, self._inboxes[bench_id],
+                                        self._rows, self._events, self._stop, log_queues, self.campaign_kwargs))
+            for bench_id, bench in enumerate(self.benches)
+        }
+        writer.start()
+        for worker in workers.values():
+            worker.start()
+        alive = set(workers)
+        try:
+            while alive or self._retiring:
+                try:
+                    self._event(*self._events.get(timeout=.5))
+                except queue.Empty:
+                    pass
+                except KeyboardInterrupt:
+                    if self._stop.is_set():
+                        raise
+                    print('stopping after the current shots, Ctrl-C again to interrupt')
+                    self._stop.set()
+
+                if writer.exitcode is not None:
+                    self._stop.set()
+                    raise RuntimeError(f'writer process ended with exitcode {writer.exitcode}')
+                for bench_id in list(alive):
+                    if workers[bench_id].exitcode is None:
+                        continue
+                    alive.discard(bench_id)
+                    if workers[bench_id].exitcode:
+                        self.failed.append(bench_id)
+                        self._retiring.add(bench_id)
+                        self._rows.put(('retire', bench_id, None))
+                    if bench_id in self._idle:
+                        self._idle.remove(bench_id)
+                if not alive and (self._requeued or self._inflight) and not self._retiring:
+                    print(f'no benches left, stopping with {len(self._requeued) + len(self._inflight)} shards to go')
+                    break
+                self._dispatch()
+        finally:
+            self._stop.set()
+            for inbox in self._inboxes:
+                inbox.put(None)
+            for worker in workers.values():
+                worker.join()
+            self._rows.put(None)
+            writer.join()
+            # What was stored while stopping
+            while True:
+                try:
+                    self._event(*self._events.get(timeout=.1))
+                except queue.Empty:
+                    break
+            for listener in listeners:
+                listener.stop()
+        return self.hist
+
+    def summary(self) -> str:
+        lines = [f'bench{bench_id} {bench}: {self.shots[bench_id]} shots{" (failed)" if bench_id in self.failed else ""}'
+                 for bench_id, bench in enumerate(self.benches)]
+        return '\n'.join(lines)
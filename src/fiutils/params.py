@@ -28,6 +28,7 @@ for ctr, settings in enumerate(pproduct(params)):
   are generated whenever a new iteration begins.
 - Use `ptotal` to return the total amount of combinations to be returned
   from a list of `Parameter`s.
+- Use `pproduct(params, start)` to continue a product at combination `start`.
 - Use `pdump` and `pload` to dump to and load from a json file.
 """
 
@@ -178,16 +179,23 @@ class Parameter2D(Parameter):
 
 
 # Custom product (instead of itertools.product) so generators with random values give new random values each iteration
-def pproduct(iters):
+def pproduct(iters, start=0):
+    """
+    With `start`, the first `start` combinations are skipped without generating them,
+    by skipping whole blocks of the inner iterators (e.g. to resume a campaign).
+    """
     if not iters:
         yield {}
     else:
-        for i in iter(iters[0]):
+        skip, start = divmod(start, ptotal(iters[1:])) if start else (0, 0)
+        for n, i in enumerate(iter(iters[0])):
+            if n < skip:
+                continue
             try:
                 key = iters[0].name
             except AttributeError:
                 key = iters[0].__class__.__name__
-            for rest in pproduct(iters[1:]):
+            for rest in pproduct(iters[1:], start if n == skip else 0):
                 if key in rest.keys():
                     raise Exception(f"multiple definitions of {key=}")
                 
@@ -205,7 +213,7 @@ def pproduct(iters):
                 yield rest
 
 def ptotal(iters):
-    return reduce(operator.mul, map(lambda x: x.total(), iters))
+    return reduce(operator.mul, map(lambda x: x.total(), iters), 1)
 
 def pdump(iters, fname):
     with open(fname, 'w') as f:
@@ -1,14 +1,162 @@
+import numpy as np
 import pandas as pd
-import holoviews as hv
 
+import json
 import operator
+from pathlib import Path
+import sqlite3
+import threading
 
 from itertools import combinations
-from typing import Iterable, Union
-from functools import reduce
+from typing import TYPE_CHECKING, Callable, Iterable, Union
+from functools import partial, reduce
 
-def sample_by(ldf: pd.DataFrame, by: str, n: int=100) -> pd.DataFrame:
-    return ldf.groupby(by).apply(lambda x: x.sample(min(n, len(x)))).reset_index(drop=True)
+from .db import VERDICT_COLUMN, db_snapshot, db_verdicts
+from .stats import bin_edges, zip_dim_bins
+
+if TYPE_CHECKING:
+    # Only for the annotations, the plots come from the hvplot accessor
+    import holoviews as hv
+
+# Colors of the groups (e.g. verdicts) in rasterized plots
+PALETTE = ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd', '#8c564b', '#e377c2', '#7f7f7f', '#bcbd22', '#17becf']
+
+# Columns of the campaigns that are booleans, SQLite stores them as 0/1
+FLAG_COLUMNS = ('stop', 'do_move', 'do_reset')
+
+def param_dtypes(params: "Union[str, Path, list[dict]]") -> "dict[str, str]":
+    """
+    Column dtypes of the parameters of a run, from its `params/<script>/<timestamp>.json`
+    dump (or the dicts in it): `'int'` or `'float'` per column, like `Parameter.dtype`.
+    """
+    if not isinstance(params, list):
+        params = json.loads(Path(params).read_text())
+    dtypes = {}
+    for param in params:
+        if param.get('itype') == '2d':
+            # np.mgrid steps, floats
+            dtypes[f'{param["name"]}0'] = dtypes[f'{param["name"]}1'] = 'float'
+        elif param.get('itype') == 'fixed':
+            if isinstance(param['min'], (int, float)):
+                dtypes[param['name']] = 'int' if isinstance(param['min'], int) else 'float'
+        else:
+            dtypes[param['name']] = param.get('dtype', 'int')
+    return dtypes
+
+def _downcast(df: pd.DataFrame, dtypes: "dict[str, str]") -> pd.DataFrame:
+    # Smallest integer dtype of every integer column, float32 for the parameters that
+    # are floats in `dtypes` (floats that are not parameters can have any precision)
+    for col in df.columns:
+        if df[col].dtype.kind in 'iu':
+            df[col] = pd.to_numeric(df[col], downcast='integer')
+        elif df[col].dtype.kind == 'f' and dtypes.get(col) == 'float':
+            df[col] = df[col].astype(np.float32)
+    return df
+
+def read_table(conn: sqlite3.Connection, table: str, dtypes: "dict[str, str]"=None, chunksize: int=100_000,
+               downcast: bool=True, columns: Iterable[str]=None) -> pd.DataFrame:
+    """
+    Read a run table, with the verdicts as a `pd.Categorical` (also for tables
+    from before the verdict dictionary).
+
+    With `downcast`, it is read `chunksize` rows at a time and every chunk gets the
+    smallest integer dtypes that hold it, the `FLAG_COLUMNS` become booleans and the
+    parameters that are floats in `dtypes` (see `param_dtypes`) become float32. Only
+    one chunk is ever held with the dtypes `pd.read_sql_query` makes. `columns`
+    reads only those columns instead of all of them.
+    """
+    sql, = conn.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name=?", (table,)).fetchone()
+    has_verdict = 'verdict' in [row[1] for row in conn.execute(f"pragma table_info('{table}')")] \
+        and (columns is None or 'verdict' in columns)
+    # Categories of the whole table, so all chunks get the same
+    if not has_verdict:
+        categories = None
+    elif VERDICT_COLUMN in sql:
+        categories = db_verdicts(conn)
+    else:
+        categories = sorted(v for v, in conn.execute(f"SELECT DISTINCT verdict FROM '{table}' WHERE verdict IS NOT NULL"))
+
+    def convert(df: pd.DataFrame) -> pd.DataFrame:
+        if has_verdict:
+            if VERDICT_COLUMN in sql:
+                df['verdict'] = pd.Categorical.from_codes(df['verdict'].fillna(-1).astype(int), categories=categories)
+            else:
+                df['verdict'] = pd.Categorical(df['verdict'], categories=categories)
+        return df
+
+    query = f"SELECT {', '.join(columns) if columns else '*'} FROM '{table}'"
+    if not downcast:
+        return convert(pd.read_sql_query(query, conn))
+    chunks = [_downcast(convert(chunk), dtypes or {}) for chunk in pd.read_sql_query(query, conn, chunksize=chunksize)]
+    if not chunks:
+        return convert(pd.read_sql_query(query, conn))
+    # Chunks can have different integer dtypes, concat takes the widest
+    df = pd.concat(chunks, ignore_index=True)
+    for col in FLAG_COLUMNS:
+        if col in df and df[col].dtype.kind == 'i' and df[col].between(0, 1).all():
+            df[col] = df[col].astype(bool)
+    return df
+
+def group_codes(values: pd.Series) -> "tuple[np.ndarray, pd.Index]":
+    # Integer code of the group of every value (-1 when missing), and the groups in order
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values.cat.codes.to_numpy(), values.cat.categories
+    codes, groups = pd.factorize(values, sort=True)
+    return codes, pd.Index(groups)
+
+def sample_by(ldf: pd.DataFrame, by: str, n: int=100, seed: int=None) -> pd.DataFrame:
+    """
+    Up to `n` random rows per value of `by`, grouped by value (rows where `by` is
+    missing are left out). All groups are sampled at once: every row gets a random
+    key, and the `n` rows with the smallest keys of every group are kept.
+    """
+    codes, groups = group_codes(ldf[by])
+    ngroups = len(groups)
+    rng = np.random.default_rng(seed)
+    keys = rng.random(len(codes))
+    counts = np.bincount(codes[codes >= 0], minlength=ngroups)
+    needed = np.minimum(counts, n)
+
+    # Only keys below about n / count can be among the n smallest of a group, so only
+    # those rows are sorted. Groups that come up short are done again with all rows.
+    # The extra 0 is the threshold of missing values (code -1).
+    thresholds = np.append(np.minimum(1, (n + 5 * np.sqrt(n) + 10) / np.maximum(counts, 1)), 0)
+    while True:
+        rows = np.flatnonzero(keys < thresholds[codes])
+        rows = rows[np.lexsort((keys[rows], codes[rows]))]
+        got = np.bincount(codes[rows], minlength=ngroups)
+        short = np.flatnonzero(got < needed)
+        if not len(short):
+            break
+        thresholds[short] = 1
+    rank = np.arange(len(rows)) - np.repeat(np.cumsum(got) - got, got)
+    return ldf.iloc[rows[rank < n]].reset_index(drop=True)
+
+def wilson_ci(k: np.ndarray, n: np.ndarray, z: float=1.96) -> "tuple[np.ndarray, np.ndarray]":
+    """Wilson score interval of the proportion `k / n` (NaN for `n = 0`), 95% for the default `z`."""
+    k, n = np.asarray(k, dtype=float), np.asarray(n, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        p = k / n
+        center = (p + z**2 / (2 * n)) / (1 + z**2 / n)
+        half = z / (1 + z**2 / n) * np.sqrt(p * (1 - p) / n + z**2 / (4 * n**2))
+    return np.clip(center - half, 0, 1), np.clip(center + half, 0, 1)
+
+def summary_counts(counts: pd.Series, z: float=1.96) -> pd.DataFrame:
+    """
+    Like `summary_by`, from counts per value (e.g. `value_counts()`): the count,
+    percent (a number) and Wilson interval (in percent) of every value, and the
+    total (without an interval).
+    """
+    counts = counts.astype(np.int64).sort_values(ascending=False)
+    total = counts.sum()
+    summary = pd.DataFrame({'count': counts})
+    summary.loc['Total'] = total
+    lo, hi = wilson_ci(summary['count'], total, z)
+    summary['percent'] = (summary['count'] / total * 100).round(2) if total else np.nan
+    summary['ci_lo'] = (lo * 100).round(2)
+    summary['ci_hi'] = (hi * 100).round(2)
+    summary.loc['Total', ['ci_lo', 'ci_hi']] = np.nan
+    return summary
 
 def summary_by(ldf: pd.DataFrame, by: str) -> pd.DataFrame:
     summary = pd.DataFrame(ldf[by].value_counts())
@@ -17,9 +165,55 @@ def summary_by(ldf: pd.DataFrame, by: str) -> pd.DataFrame:
     summary['percent'] = summary['percent'].apply(lambda x: f'{x:.2f}')
     return summary
 
-def multi_scatter(df: pd.DataFrame, dims: Iterable[str], by: str='verdict', nsample: int=None, ncols: int=2, *args, **kwargs) -> hv.NdLayout:
+def stream_counts(chunks: Iterable, by: str='verdict') -> pd.Series:
+    """
+    Counts per value of `by`, one chunk of rows at a time, e.g. of
+    `pd.read_sql_query(..., chunksize=100_000)` or of the files of an export.
+    """
+    counts = pd.Series(dtype=np.int64)
+    for chunk in chunks:
+        values = chunk[by] if isinstance(chunk, pd.DataFrame) else chunk
+        counts = counts.add(values.value_counts(), fill_value=0)
+    return counts.astype(np.int64)
+
+def db_counts(conn: sqlite3.Connection, table: str, by: str='verdict', where: str=None, params: Iterable=()) -> pd.Series:
+    """Counts per value of `by` in a table, counted by SQLite (verdicts as strings)."""
+    res = conn.execute(f'SELECT "{by}", count() FROM \'{table}\'' + (f" WHERE {where}" if where else '')
+                       + f' GROUP BY "{by}"', tuple(params)).fetchall()
+    sql, = conn.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name=?", (table,)).fetchone()
+    if by == 'verdict' and VERDICT_COLUMN in sql:
+        names = db_verdicts(conn)
+        res = [(None if code is None else names[code], count) for code, count in res]
+    return pd.Series(dict(res), dtype=np.int64).rename_axis(by)
+
+def db_summary(conn: sqlite3.Connection, tables: "Union[str, Iterable[str]]", by: str='verdict', where: str=None,
+               params: Iterable=(), per_table: bool=False, z: float=1.96) -> pd.DataFrame:
+    """
+    `summary_counts` of one or more tables (e.g. all runs of a script), without reading
+    their rows: only the counts per value leave the database. With `per_table`, a
+    summary per table (index table, value), otherwise of all tables together.
+    """
+    tables = [tables] if isinstance(tables, str) else list(tables)
+    counts = {table: db_counts(conn, table, by, where, params) for table in tables}
+    if per_table:
+        return pd.concat({table: summary_counts(c, z) for table, c in counts.items()}, names=['table', by])
+    return summary_counts(reduce(lambda a, b: a.add(b, fill_value=0), counts.values()), z)
+
+def multi_scatter(df: pd.DataFrame, dims: Iterable[str], by: str='verdict', nsample: int=None, ncols: int=2, *args,
+                  seed: int=None, rasterize: bool=False, pixels: int=300, **kwargs) -> 'hv.NdLayout':
+    """
+    Scatter plots of all pairs of `dims`, colored `by`. With `nsample`, at most that
+    many points per value of `by` (reproducible with a `seed`).
+
+    With `rasterize`, all points are counted per value of `by` in a `pixels` x `pixels`
+    grid per pair instead, and every grid is drawn as a single image (the colors of
+    the values mixed by count, opacity by total count). The plot does not get bigger
+    with the number of shots. `kwargs` then go to the options of the images.
+    """
+    if rasterize:
+        return multi_raster(df, dims, by, ncols, pixels, **kwargs)
     if nsample:
-        df_sample = sample_by(df, by, n=nsample)
+        df_sample = sample_by(df, by, n=nsample, seed=seed)
     else:
         df_sample = df
     plts = []
@@ -76,28 +270,413 @@ def bin_cut(df: pd.DataFrame, dims: Iterable[str], bins: Union[Iterable[int], in
         
     return df_binned
 
-def multi_heat2d(df: pd.DataFrame, dims: Iterable[str], filter: Union[None, pd.Series]=None, bins: Union[Iterable[int], int]=10, vmin_to_zero: bool=False, ncols: int=2, shared_axes: bool=False, *args, **kwargs) -> Union[hv.NdLayout, hv.HeatMap]:
-    # Perform any filtering after cutting for consistent bins
-    df_binned = bin_cut(df, dims, bins=bins)
-    
-    for dim in dims:
-        # Need to convert the labels to string, or we get exceptions further down the pipeline
-        df_binned[dim] = df_binned[dim].apply(str)
+def bin_codes(df: pd.DataFrame, dims: Iterable[str], bins: Union[Iterable[int], int]=10) -> "tuple[dict[str, np.ndarray], dict[str, np.ndarray]]":
+    """
+    Integer bin codes per dim, with the same (right closed) bins as `bin_cut`, and
+    the edges of those bins. Values outside of the bins (or NaN) get code -1.
+    """
+    codes, edges = {}, {}
+    for dim, bin in zip_dim_bins(dims, bins):
+        values = df[dim].to_numpy(dtype=float)
+        edges[dim] = bin_edges(values, bin)
+        code = np.searchsorted(edges[dim], values, side='left') - 1
+        code[code >= len(edges[dim]) - 1] = -1
+        codes[dim] = code
+    return codes, edges
+
+def bin_labels(edges: np.ndarray) -> "list[str]":
+    # The labels `bin_cut` would have, as strings
+    return list(pd.cut(np.array([], dtype=float), edges).categories.astype(str))
+
+def hist2d_codes(x: np.ndarray, y: np.ndarray, nx: int, ny: int, mask: np.ndarray=None) -> np.ndarray:
+    """2D histogram (`ny` rows, `nx` columns) of bin codes, in one `np.bincount`."""
+    valid = (x >= 0) & (y >= 0)
+    if mask is not None:
+        valid &= mask
+    return np.bincount(y[valid] * nx + x[valid], minlength=nx * ny).reshape(ny, nx)
+
+def hist2d_groups(x: np.ndarray, y: np.ndarray, groups: np.ndarray, ngroups: int, nx: int, ny: int) -> np.ndarray:
+    """2D histograms per group (`ngroups` x `ny` rows x `nx` columns) of bin codes, in one `np.bincount`."""
+    valid = (x >= 0) & (y >= 0) & (groups >= 0)
+    counts = hist2d_codes(x[valid], groups[valid].astype(np.int64) * ny + y[valid], nx, ngroups * ny)
+    return counts.reshape(ngroups, ny, nx)
+
+def raster2d(x: np.ndarray, y: np.ndarray, groups: np.ndarray, ngroups: int, pixels: int) -> np.ndarray:
+    """Counts per group (`ngroups` x `pixels` rows x `pixels` columns) of pixel codes."""
+    return hist2d_groups(x, y, groups, ngroups, pixels, pixels)
+
+def raster_rgba(counts: np.ndarray, colors: "list[str]") -> np.ndarray:
+    # RGBA image of per group counts: the group colors weighted by count, more opaque with more shots
+    rgb = np.array([[int(c[i:i + 2], 16) for i in (1, 3, 5)] for c in colors], dtype=float)
+    total = counts.sum(axis=0)
+    image = np.zeros(total.shape + (4,), dtype=np.uint8)
+    hit = total > 0
+    image[hit, :3] = (np.tensordot(counts, rgb, axes=(0, 0))[hit] / total[hit, None]).astype(np.uint8)
+    image[hit, 3] = 64 + 191 * np.log1p(total[hit]) / np.log1p(total.max())
+    return image
+
+def multi_raster(df: pd.DataFrame, dims: Iterable[str], by: str='verdict', ncols: int=2, pixels: int=300, **kwargs) -> 'hv.NdLayout':
+    # See `multi_scatter(..., rasterize=True)`
+    import holoviews as hv
+    codes, edges = bin_codes(df, dims, bins=pixels)
+    groups, labels = group_codes(df[by])
+    colors = [PALETTE[i % len(PALETTE)] for i in range(len(labels))]
 
     plts = []
     combs = list(combinations(dims, 2))
     for idx, (x, y) in enumerate(combs):
-        df_plot = df_binned
-        if not isinstance(filter, type(None)):
-            df_plot = df_binned[filter]
-        hist = df_plot.reset_index().groupby([y, x], observed=False)['index'].count()
-        if vmin_to_zero:
-            clim=(0, hist.max())
+        image = raster_rgba(raster2d(codes[x], codes[y], groups, len(labels), pixels), colors)
+        # Row 0 of an image is the top
+        rgb = hv.RGB(image[::-1], bounds=(edges[x][0], edges[y][0], edges[x][-1], edges[y][-1]), kdims=[x, y]).opts(**kwargs)
+        # Empty points for the legend
+        legend = [hv.Points([], kdims=[x, y], label=str(label)).opts(color=color) for label, color in zip(labels, colors)]
+        plts.append(hv.Overlay([rgb, *legend]).opts(xlabel=x, ylabel=y))
+    layout = reduce(operator.add, plts)
+    if len(combs) > 1:
+        return layout.cols(ncols)
+    return layout
+
+def heatmap(counts: np.ndarray, x: str, y: str, xlabels: "list[str]", ylabels: "list[str]", vmin_to_zero: bool=False, *args,
+            mask_empty: bool=False, **kwargs) -> 'hv.HeatMap':
+    # Empty bins are 0 like any other count, with `mask_empty` they are left blank instead
+    # (and out of the color limits). The multi_heat2d* functions pass it on with kwargs.
+    hist = pd.DataFrame(counts, index=pd.Index(ylabels, name=y), columns=pd.Index(xlabels, name=x))
+    if mask_empty:
+        hist = hist.where(counts > 0)
+    if vmin_to_zero:
+        clim=(0, hist.max().max())
+    else:
+        clim=(hist.min().min(), hist.max().max())
+    return hist.hvplot.heatmap(*args, clim=clim, **kwargs).opts(xrotation=45, xlabel=x, ylabel=y)
+
+def multi_heat2d(df: pd.DataFrame, dims: Iterable[str], filter: Union[None, pd.Series]=None, bins: Union[Iterable[int], int]=10, vmin_to_zero: bool=False, ncols: int=2, shared_axes: bool=False, *args, **kwargs) -> 'Union[hv.NdLayout, hv.HeatMap]':
+    # Bins come from all of df, any filtering is done after binning for consistent bins.
+    # Every dim is binned once, the labels are only made for the plots.
+    codes, edges = bin_codes(df, dims, bins=bins)
+    labels = {dim: bin_labels(edges[dim]) for dim in dims}
+    mask = None if filter is None else np.asarray(filter, dtype=bool)
+
+    plts = []
+    combs = list(combinations(dims, 2))
+    for idx, (x, y) in enumerate(combs):
+        counts = hist2d_codes(codes[x], codes[y], len(labels[x]), len(labels[y]), mask)
+        plts.append(heatmap(counts, x, y, labels[x], labels[y], vmin_to_zero, *args, **kwargs))
+    layout = reduce(operator.add, plts).opts(shared_axes=shared_axes)
+    if len(combs) > 1:
+        return layout.cols(ncols)
+    return layout
+
+def runs_hist2d(df: "Union[pd.DataFrame, dict[str, pd.DataFrame]]", dims: Iterable[str], by: str='run',
+                filter: "Union[None, pd.Series, Callable]"=None, bins: Union[Iterable[int], int]=10
+                ) -> "tuple[dict[tuple[str, str], tuple[np.ndarray, np.ndarray]], pd.Index, dict[str, np.ndarray]]":
+    """
+    2D histograms of every pair of `dims` for every run, all on the same bins: per pair
+    the shots and the shots matching `filter` (runs x y bins x x bins), the runs and the
+    edges. `df` has a `by` column, or is a dict of frames per run. `filter` is a mask
+    or a function of the frame (e.g. `lambda df: df.verdict == 'GLITCH00'`).
+
+    Every dim is binned once for all runs, the bins come from all runs together.
+    """
+    if isinstance(df, dict):
+        df = pd.concat({run: frame[list(dims)] if not callable(filter) else frame for run, frame in df.items()},
+                       names=[by]).reset_index(level=0).reset_index(drop=True)
+    codes, edges = bin_codes(df, dims, bins=bins)
+    groups, runs = group_codes(df[by])
+    if callable(filter):
+        filter = filter(df)
+    mask = None if filter is None else np.asarray(filter, dtype=bool)
+
+    hists = {}
+    for x, y in combinations(dims, 2):
+        nx, ny = len(edges[x]) - 1, len(edges[y]) - 1
+        shots = hist2d_groups(codes[x], codes[y], groups, len(runs), nx, ny)
+        if mask is None:
+            hits = shots
+        else:
+            hits = hist2d_groups(codes[x][mask], codes[y][mask], groups[mask], len(runs), nx, ny)
+        hists[(x, y)] = (shots, hits)
+    return hists, runs, edges
+
+def compare_heat2d(df: "Union[pd.DataFrame, dict[str, pd.DataFrame]]", dims: Iterable[str], by: str='run',
+                   filter: "Union[None, pd.Series, Callable]"=None, bins: Union[Iterable[int], int]=10,
+                   baseline: str=None, mode: str='diff', ncols: int=None, shared_axes: bool=False,
+                   *args, **kwargs) -> 'hv.Layout':
+    """
+    Heatmaps of every run against `baseline` (the first run by default), per pair of
+    `dims` on bins shared by all runs (see `runs_hist2d`). Runs rarely have the same
+    number of shots per bin, so rates are compared: the fraction of the shots of a bin
+    that match `filter`, or without `filter` the fraction of the shots of the run that
+    are in the bin. `mode` is `'diff'` (run - baseline) or `'ratio'` (run / baseline).
+
+    ```
+    compare_heat2d({'v1.0': df_v10, 'v1.1': df_v11}, dims, filter=lambda df: df.verdict == 'GLITCH00')
+    ```
+    """
+    if mode not in ('diff', 'ratio'):
+        raise ValueError(f'Do not like {mode=}')
+    import holoviews as hv
+    hists, runs, edges = runs_hist2d(df, dims, by, filter, bins)
+    labels = {dim: bin_labels(edges[dim]) for dim in edges}
+    base = 0 if baseline is None else runs.get_loc(baseline)
+    others = [i for i in range(len(runs)) if i != base]
+    if not others:
+        raise ValueError(f'Need at least two runs to compare, got {list(runs)}')
+    kwargs.setdefault('cmap', 'RdBu_r')
+
+    plts = []
+    for (x, y), (shots, hits) in hists.items():
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if filter is None:
+                rates = shots / shots.sum(axis=(1, 2), keepdims=True)
+            else:
+                rates = np.where(shots > 0, hits / shots, np.nan)
+            for i in others:
+                if mode == 'diff':
+                    values = rates[i] - rates[base]
+                    lim = np.nanmax(np.abs(values), initial=0) or 1
+                    clim = (-lim, lim)
+                else:
+                    values = np.where(rates[base] > 0, rates[i] / rates[base], np.nan)
+                    lim = np.nanmax(np.abs(np.log(values[values > 0])), initial=0) or 1
+                    clim = (np.exp(-lim), np.exp(lim))
+                hist = pd.DataFrame(values, index=pd.Index(labels[y], name=y), columns=pd.Index(labels[x], name=x))
+                title = f'{runs[i]} {"-" if mode == "diff" else "/"} {runs[base]}'
+                plts.append(hist.hvplot.heatmap(*args, clim=clim, logz=mode == 'ratio', **kwargs)
+                            .opts(xrotation=45, xlabel=x, ylabel=y, title=title))
+    return hv.Layout(plts).opts(shared_axes=shared_axes).cols(ncols or len(others))
+
+# The same heatmaps, counted by SQLite on a run (or archive) table instead of in a
+# DataFrame: only the counts per bin leave the database.
+
+def db_ranges(conn: sqlite3.Connection, table: str, dims: Iterable[str], where: str=None,
+              params: Iterable=()) -> "dict[str, tuple[float, float]]":
+    # (min, max) of every dim in one query, (None, None) for a dim without values
+    cols = ', '.join(f'min("{dim}"), max("{dim}")' for dim in dims)
+    res = conn.execute(f"SELECT {cols} FROM '{table}'" + (f" WHERE {where}" if where else ''), tuple(params)).fetchone()
+    return {dim: res[2 * i:2 * i + 2] for i, dim in enumerate(dims)}
+
+def db_bin_edges(conn: sqlite3.Connection, table: str, dims: Iterable[str], bins: Union[Iterable[int], int]=10,
+                 where: str=None, params: Iterable=(), ranges: "dict[str, tuple[float, float]]"=None) -> "dict[str, np.ndarray]":
+    """Edges of the bins of `dims` like `bin_codes` would make them, from one min/max query (or `ranges`)."""
+    ranges = ranges or db_ranges(conn, table, dims, where, params)
+    edges = {}
+    for dim, bin in zip_dim_bins(dims, bins):
+        if ranges[dim][0] is None:
+            raise ValueError(f'{table=} has no values for {dim=}')
+        edges[dim] = bin_edges(np.array(ranges[dim], dtype=float), bin)
+    return edges
+
+def bin_sql(column: str, edges: np.ndarray, equal_width: bool=True) -> str:
+    """
+    SQL expression for the code of the (right closed) bin of `column`, NULL outside
+    of the bins. Equal width bins are computed, other bins go through a CASE.
+    """
+    # Plain floats, their repr is valid SQL
+    edges = [float(edge) for edge in edges]
+    n = len(edges) - 1
+    if not equal_width:
+        whens = ' '.join(f'WHEN "{column}" <= {edge!r} THEN {i}' for i, edge in enumerate(edges[1:]))
+        return f'(CASE WHEN "{column}" <= {edges[0]!r} THEN NULL {whens} END)'
+    if n == 1:
+        return f'(CASE WHEN "{column}" > {edges[0]!r} AND "{column}" <= {edges[1]!r} THEN 0 END)'
+    # The first bin is wider (like pd.cut), so count down from the top: a value in
+    # (top - (k + 1) * width, top - k * width] is in bin n - 1 - k
+    width = (edges[-1] - edges[1]) / (n - 1)
+    return (f'(CASE WHEN "{column}" > {edges[0]!r} AND "{column}" <= {edges[-1]!r} '
+            f'THEN max({n - 1} - CAST(({edges[-1]!r} - "{column}") / {width!r} AS INTEGER), 0) END)')
+
+def _verdict_filter(conn: sqlite3.Connection, table: str, verdicts: "Iterable[str]") -> "tuple[str, tuple]":
+    # WHERE clause for `verdicts`, on the codes for encoded tables, so the verdict index can be used
+    sql, = conn.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name=?", (table,)).fetchone()
+    if VERDICT_COLUMN in sql:
+        known = db_verdicts(conn)
+        values = tuple(known.index(v) for v in verdicts if v in known)
+    else:
+        values = tuple(verdicts)
+    return f"verdict IN ({', '.join('?' * len(values))})", values
+
+def db_histdd(conn: sqlite3.Connection, table: str, dims: Iterable[str], edges: "dict[str, np.ndarray]", equal_width: "dict[str, bool]"=None,
+              verdicts: "Iterable[str]"=None, where: str=None, params: Iterable=()) -> "tuple[np.ndarray, list[str]]":
+    """
+    N-dimensional histogram per verdict of `dims` of a table, counted by SQLite in one
+    GROUP BY on the cell of every row. Returns the counts (verdicts x bins of `dims[0]`
+    x bins of `dims[1]` ...) and the verdicts. Every dim has one extra bin at the end,
+    for values that are NULL or outside of the bins.
+
+    `edges` come from `db_bin_edges`, `equal_width` tells per dim whether they are equal
+    width bins (the default) or given edges. With `verdicts`, only the shots with those
+    verdicts are counted, `where` (with `params`) is an extra condition.
+    """
+    equal_width = equal_width or {}
+    shape = [len(edges[dim]) for dim in dims]
+    terms, stride = [], 1
+    for dim, n in reversed(list(zip(dims, shape))):
+        terms.append(f'coalesce({bin_sql(dim, edges[dim], equal_width.get(dim, True))}, {n - 1}) * {stride}')
+        stride *= n
+
+    conditions, values = [], tuple(params)
+    if where:
+        conditions.append(f'({where})')
+    if verdicts is not None:
+        condition, codes = _verdict_filter(conn, table, verdicts)
+        conditions.append(condition)
+        values += codes
+    res = conn.execute(f"SELECT {' + '.join(reversed(terms))} AS cell, verdict, count() FROM '{table}'"
+                       + (f" WHERE {' AND '.join(conditions)}" if conditions else '')
+                       + " GROUP BY cell, verdict", values).fetchall()
+
+    # Verdicts in the order of the dictionary (or alphabetical for tables with strings)
+    raw = sorted({verdict for _, verdict, _ in res}, key=lambda v: (v is None, v))
+    sql, = conn.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name=?", (table,)).fetchone()
+    names = db_verdicts(conn) if VERDICT_COLUMN in sql else None
+    index = {verdict: i for i, verdict in enumerate(raw)}
+    counts = np.zeros((len(raw), stride), dtype=np.int64)
+    for cell, verdict, count in res:
+        counts[index[verdict], cell] = count
+    labels = [names[v] if names is not None and v is not None else v for v in raw]
+    return counts.reshape(len(raw), *shape), labels
+
+def histdd_sql(conn: sqlite3.Connection, table: str, dims: Iterable[str], bins: Union[Iterable[int], int]=10,
+               verdicts: "Iterable[str]"=None, where: str=None, params: Iterable=()) -> "tuple[np.ndarray, list[str], dict[str, np.ndarray]]":
+    """`db_histdd` with the bins of `db_bin_edges`, returns the counts, verdicts and edges."""
+    edges = db_bin_edges(conn, table, dims, bins, where, params)
+    equal_width = {dim: not np.ndim(bin) for dim, bin in zip_dim_bins(dims, bins)}
+    return (*db_histdd(conn, table, dims, edges, equal_width, verdicts, where, params), edges)
+
+class HistCache():
+    """
+    `histdd_sql` results that are kept up to date: per (db, table, dims, bins, verdicts,
+    where) the counts are stored with the last rowid counted, and a next call only
+    counts the rows added since. When new values fall outside of the range the bins
+    were made for, the bins change and everything is counted again.
+
+    ```
+    cache = HistCache()
+    multi_heat2d_sql(conn, table, dims, cache=cache)   # counts the table
+    multi_heat2d_sql(conn, table, dims, cache=cache)   # counts the new shots only
+    ```
+    """
+    def __init__(self) -> None:
+        self.entries = {}
+        self._lock = threading.Lock()
+
+    def histdd(self, conn: sqlite3.Connection, table: str, dims: Iterable[str], bins: Union[Iterable[int], int]=10,
+               verdicts: "Iterable[str]"=None, where: str=None, params: Iterable=()) -> "tuple[np.ndarray, list[str], dict[str, np.ndarray]]":
+        dims = list(dims)
+        dim_bins = list(zip_dim_bins(dims, bins))
+        db_file = conn.execute('PRAGMA database_list').fetchone()[2]
+        key = (db_file, table, tuple(dims), tuple(tuple(np.ravel(bin).tolist()) for _, bin in dim_bins),
+               None if verdicts is None else tuple(verdicts), where, tuple(params))
+        last, = conn.execute(f"SELECT max(rowid) FROM '{table}'").fetchone()
+        last = last or 0
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry['rowid'] == last:
+                return self._result(entry)
+
+            # Only the rows after the ones counted, if the bins still fit them
+            first = 0 if entry is None or last < entry['rowid'] else entry['rowid']
+            rows = f'rowid > {first} AND rowid <= {last}' + (f' AND ({where})' if where else '')
+            ranges = db_ranges(conn, table, dims, rows, params)
+            if first:
+                for dim, bin in dim_bins:
+                    lo, hi = ranges[dim]
+                    old_lo, old_hi = entry['ranges'][dim]
+                    ranges[dim] = (old_lo if lo is None else min(lo, old_lo), old_hi if hi is None else max(hi, old_hi))
+                    if not np.ndim(bin) and ranges[dim] != (old_lo, old_hi):
+                        # New range, new bins
+                        first = 0
+                if not first:
+                    rows = f'rowid <= {last}' + (f' AND ({where})' if where else '')
+            edges = db_bin_edges(conn, table, dims, bins, ranges=ranges)
+            equal_width = {dim: not np.ndim(bin) for dim, bin in dim_bins}
+            counts, labels = db_histdd(conn, table, dims, edges, equal_width, verdicts, rows, params)
+
+            if first:
+                for label, count in zip(labels, counts):
+                    if label in entry['counts']:
+                        entry['counts'][label] += count
+                    else:
+                        entry['counts'][label] = count
+            else:
+                entry = self.entries[key] = {'counts': dict(zip(labels, counts)), 'edges': edges}
+            entry['rowid'] = last
+            entry['ranges'] = ranges
+            return self._result(entry)
+
+    def _result(self, entry: dict) -> "tuple[np.ndarray, list[str], dict[str, np.ndarray]]":
+        shape = [len(edges) for edges in entry['edges'].values()]
+        counts = np.array(list(entry['counts'].values())) if entry['counts'] else np.zeros((0, *shape), dtype=np.int64)
+        return counts, list(entry['counts']), entry['edges']
+
+def _pair_counts(total: np.ndarray, dims: "list[str]", x: str, y: str) -> np.ndarray:
+    # 2D histogram (y rows, x columns) out of an N-dimensional one, without the extra bins
+    i, j = dims.index(x), dims.index(y)
+    pair = total.sum(axis=tuple(k for k in range(len(dims)) if k not in (i, j)))
+    return (pair if i > j else pair.T)[:-1, :-1]
+
+def multi_heat2d_sql(conn: sqlite3.Connection, table: str, dims: Iterable[str], verdicts: "Iterable[str]"=None,
+                     where: str=None, params: Iterable=(), bins: Union[Iterable[int], int]=10, vmin_to_zero: bool=False,
+                     ncols: int=2, shared_axes: bool=False, max_cells: int=100_000, cache: HistCache=None,
+                     *args, **kwargs) -> 'Union[hv.NdLayout, hv.HeatMap]':
+    """
+    `multi_heat2d` of a table, with `verdicts` in the role of `filter` (e.g. `['GLITCH00']`)
+    and `where` (with `params`, e.g. `'run = ?'` for an archive) in the role of the
+    frame: the bins come from the rows matching `where`.
+
+    When all dims have at most `max_cells` cells together, the table is scanned once
+    for all pairs (`db_histdd` of all dims), otherwise once per pair. With a `cache`,
+    only the rows added since the last call are counted.
+    """
+    dims = list(dims)
+    dim_bins = dict(zip_dim_bins(dims, bins))
+    hist = histdd_sql if cache is None else cache.histdd
+    single_scan = np.prod([len(bin) if np.ndim(bin) else bin + 1 for bin in dim_bins.values()]) <= max_cells
+    if single_scan:
+        counts, _, edges = hist(conn, table, dims, bins, verdicts, where, params)
+        total = counts.sum(axis=0)
+
+    plts = []
+    combs = list(combinations(dims, 2))
+    for idx, (x, y) in enumerate(combs):
+        if single_scan:
+            pair = _pair_counts(total, dims, x, y)
         else:
-            clim=(hist.min(), hist.max()) 
-        plts.append(
-            hist.unstack().hvplot.heatmap(*args, clim=clim, **kwargs).opts(xrotation=45, xlabel=x, ylabel=y))
+            counts, _, edges = hist(conn, table, [y, x], [dim_bins[y], dim_bins[x]], verdicts, where, params)
+            pair = counts.sum(axis=0)[:-1, :-1]
+        plts.append(heatmap(pair, x, y, bin_labels(edges[x]), bin_labels(edges[y]), vmin_to_zero, *args, **kwargs))
     layout = reduce(operator.add, plts).opts(shared_axes=shared_axes)
     if len(combs) > 1:
         return layout.cols(ncols)
     return layout
+
+def live_heat2d(db_name: str, table: str, dims: Iterable[str], verdicts: "Iterable[str]"=None, where: str=None,
+                params: Iterable=(), bins: Union[Iterable[int], int]=10, vmin_to_zero: bool=False, ncols: int=2,
+                period_s: float=2.0, timeout_s: float=12 * 3600, cache: HistCache=None,
+                *args, **kwargs) -> 'hv.Layout':
+    """
+    `multi_heat2d_sql` of a table that is being written, e.g. by a running campaign:
+    every `period_s` (for `timeout_s`) the heatmaps are updated, counting only the
+    shots added since.
+    """
+    import holoviews as hv
+    dims = list(dims)
+    cache = cache or HistCache()
+
+    def pair(x, y, counter=0):
+        # Every update reads in its own short read transaction, so the campaign can checkpoint
+        with db_snapshot(db_name) as conn:
+            counts, _, edges = cache.histdd(conn, table, dims, bins, verdicts, where, params)
+        return heatmap(_pair_counts(counts.sum(axis=0), dims, x, y), x, y, bin_labels(edges[x]), bin_labels(edges[y]),
+                       vmin_to_zero, *args, **kwargs)
+
+    plts = []
+    combs = list(combinations(dims, 2))
+    for idx, (x, y) in enumerate(combs):
+        dmap = hv.DynamicMap(partial(pair, x, y), streams=[hv.streams.Counter()])
+        dmap.periodic(period_s, timeout=timeout_s, block=False)
+        plts.append(dmap)
+    layout = reduce(operator.add, plts)
+    if len(combs) > 1:
+        return layout.cols(ncols)
+    return layout
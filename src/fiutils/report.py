@@ -0,0 +1,148 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing
+import html
+from pathlib import Path
+import sqlite3
+from typing import TYPE_CHECKING
+
+from .archive import RUN_PREFIX, script_name
+from .db import db_snapshot
+
+if TYPE_CHECKING:
+    # Only for the annotations, the workers import it
+    import pandas as pd
+
+"""
+Static reports of finished runs, for reviewing them without opening Jupyter.
+
+```
+python -m fiutils.report data/000-simple-template-db2.db [tab_<timestamp> ...] --out reports --jobs 4
+```
+
+For every run (by default every `tab_*` table of the database) `<out>/<script>/` gets
+- `<run>.summary.csv`: verdict counts, percentages and Wilson intervals (`db_summary`)
+- `<run>.heat2d.html`: `multi_heat2d_sql` of the glitch verdicts (`--verdicts`),
+  counted by SQLite
+- `<run>.scatter.html`: `multi_scatter(rasterize=True)` of all shots, or a sample of
+  `--nsample` shots per verdict
+
+and `index.html` has the summaries of all runs, with links to their plots. Runs are
+done in parallel by a pool of `--jobs` processes, every one reads the database in
+its own read-only snapshot, so a running campaign can keep writing. `--format png`
+writes png files instead, which needs what `hv.save` needs for that (selenium and
+a browser driver).
+
+The dims are the parameters with more than one value, from the params dump of the
+run when it is next to the database (`params/<script>/<timestamp>.json`), otherwise
+the numeric columns with more than one value, except `idx`, `bench` and 0/1 flags.
+"""
+
+# Columns that are numbers, but not parameters
+SKIP_DIMS = ('idx', 'bench')
+
+def report_runs(db_name: str) -> "list[str]":
+    """The run tables of `db_name`, oldest first."""
+    with closing(sqlite3.connect(db_name)) as conn:
+        return [name for name, in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type='table' AND name LIKE ? ORDER BY name", (RUN_PREFIX + '%',))]
+
+def _report_dims(conn: sqlite3.Connection, table: str, dtypes: "dict[str, str]"=None) -> "list[str]":
+    # The parameters (from `param_dtypes`) with more than one value, or without them the
+    # numeric columns with more than one value that are not 0/1 flags (`do_reset` ...)
+    from .plot import db_ranges
+    columns = [row[1] for row in conn.execute(f"pragma table_info('{table}')")
+               if row[1] not in SKIP_DIMS and row[1] != 'verdict' and (not dtypes or row[1] in dtypes)]
+    if not columns:
+        return []
+    ranges = db_ranges(conn, table, columns)
+    return [col for col in columns
+            if all(isinstance(v, (int, float)) for v in ranges[col]) and ranges[col][0] != ranges[col][1]
+            and (dtypes or tuple(ranges[col]) != (0, 1))]
+
+def report_run(db_name: str, table: str, out, dims: "list[str]"=None, verdicts: "list[str]"=None,
+               bins: int=10, nsample: int=None, fmt: str='html') -> 'pd.DataFrame':
+    """Write the summary and plots of one run to `out`, returns the summary."""
+    import holoviews as hv
+    import hvplot.pandas  # noqa: F401, the .hvplot accessor
+    from .plot import db_summary, multi_heat2d_sql, multi_scatter, param_dtypes, read_table
+    hv.extension('bokeh')
+    hv.opts.defaults(hv.opts.Scatter(width=500, height=300), hv.opts.HeatMap(width=500, height=400))
+
+    out = Path(out)
+    out.mkdir(parents=True, exist_ok=True)
+    params_dump = Path(db_name).resolve().parent.parent / 'params' / script_name(db_name) / f'{table[len(RUN_PREFIX):]}.json'
+    dtypes = param_dtypes(params_dump) if params_dump.exists() else None
+    with db_snapshot(db_name) as conn:
+        summary = db_summary(conn, table)
+        summary.to_csv(out / f'{table}.summary.csv')
+        dims = dims or _report_dims(conn, table, dtypes)
+        if len(dims) < 2:
+            return summary
+
+        glitches = verdicts or [v for v in summary.index if v != 'Total' and 'GLITCH' in str(v)]
+        if glitches:
+            layout = multi_heat2d_sql(conn, table, dims, verdicts=glitches, bins=bins, ncols=3, cmap='magma')
+            hv.save(layout.opts(title=f'{table} {", ".join(glitches)}'), out / f'{table}.heat2d.{fmt}', fmt=fmt)
+
+        # Only what the scatter plots, every worker holds its table
+        df = read_table(conn, table, dtypes, columns=[*dims, 'verdict'])
+    if nsample:
+        layout = multi_scatter(df, dims, 'verdict', nsample=nsample, ncols=3, size=10)
+    else:
+        layout = multi_scatter(df, dims, 'verdict', ncols=3, rasterize=True, width=500, height=400)
+    hv.save(layout.opts(title=table), out / f'{table}.scatter.{fmt}', fmt=fmt)
+    return summary
+
+def _index_html(db_name: str, summaries: "dict[str, pd.DataFrame]", failed: "dict[str, str]", out: Path, fmt: str) -> str:
+    parts = [f'<html><head><meta charset="utf-8"><title>{html.escape(str(db_name))}</title></head><body>',
+             f'<h1>{html.escape(str(db_name))}</h1>']
+    for run, summary in summaries.items():
+        links = ' '.join(f'<a href="{run}.{kind}.{fmt}">{kind}</a>' for kind in ('heat2d', 'scatter')
+                         if (out / f'{run}.{kind}.{fmt}').exists())
+        parts.append(f'<h2>{html.escape(run)}</h2><p>{links}</p>{summary.to_html()}')
+    for run, error in failed.items():
+        parts.append(f'<h2>{html.escape(run)}</h2><pre>{html.escape(error)}</pre>')
+    parts.append('</body></html>')
+    return '\n'.join(parts)
+
+def report(db_name: str, runs: "list[str]"=None, out='reports', jobs: int=None, **kwargs) -> "dict[str, pd.DataFrame]":
+    """
+    `report_run` for `runs` (all runs by default) of `db_name` in a pool of `jobs`
+    processes, into `out/<script>/`, and the `index.html` of them. Returns the
+    summaries of the runs that succeeded.
+    """
+    runs = runs or report_runs(db_name)
+    out = Path(out) / script_name(db_name)
+    summaries, failed = {}, {}
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {run: pool.submit(report_run, db_name, run, out, **kwargs) for run in runs}
+        for run, future in futures.items():
+            try:
+                summaries[run] = future.result()
+                print(f'{db_name}:{run} -> {out}')
+            except Exception as e:
+                failed[run] = f'{type(e).__name__}: {e}'
+                print(f'{db_name}:{run} failed: {failed[run]}')
+    out.mkdir(parents=True, exist_ok=True)
+    (out / 'index.html').write_text(_index_html(db_name, summaries, failed, out, kwargs.get('fmt', 'html')))
+    return summaries
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Write summaries and plots of runs as static files')
+    parser.add_argument('db', help='database with tab_* run tables')
+    parser.add_argument('runs', nargs='*', help='run tables, all of them by default')
+    parser.add_argument('--out', default='reports', help='directory for the reports, one subdirectory per script')
+    parser.add_argument('--jobs', type=int, default=None, help='processes, one per cpu by default')
+    parser.add_argument('--dims', nargs='+', default=None, help='columns to plot, the numeric parameters by default')
+    parser.add_argument('--verdicts', nargs='+', default=None, help="verdicts of the heatmaps, those with 'GLITCH' by default")
+    parser.add_argument('--bins', type=int, default=10, help='bins per dim of the heatmaps')
+    parser.add_argument('--nsample', type=int, default=None, help='scatter this many shots per verdict instead of rasterizing all')
+    parser.add_argument('--format', dest='fmt', choices=['html', 'png'], default='html')
+    args = parser.parse_args()
+
+    runs = args.runs or report_runs(args.db)
+    summaries = report(args.db, runs, args.out, args.jobs, dims=args.dims, verdicts=args.verdicts,
+                       bins=args.bins, nsample=args.nsample, fmt=args.fmt)
+    print(f'{len(summaries)}/{len(runs)} runs reported in {Path(args.out) / script_name(args.db)}')
+    raise SystemExit(0 if len(summaries) == len(runs) else 1)
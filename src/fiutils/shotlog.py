@@ -0,0 +1,205 @@
+from contextlib import closing
+import json
+import mmap
+from pathlib import Path
+import sqlite3
+import struct
+import time
+
+import numpy as np
+
+from .db import db_append_row, db_create_indexes, db_setup
+
+"""
+Append-only binary shot log, for campaigns that produce shots faster than SQLite
+can take them.
+
+```
+with ShotLog(f'data/{fname}-{timestamp}.shots') as log:
+    for idx, settings in progress:
+        p = SimpleNamespace(**settings)
+        ...
+        log.append(p.__dict__)
+
+records = shotlog_read(f'data/{fname}-{timestamp}.shots')  # numpy structured array
+shotlog_to_db(f'data/{fname}-{timestamp}.shots', db_name, table_name)
+```
+
+The record layout is derived from the first row appended: `bool`, `int`, `float`
+and numpy scalars map to the matching numpy dtype, `str` to a fixed width bytes
+field of `str_width`. Every row after that must have the same keys.
+
+File layout: 8 byte magic, uint64 record count, uint32 header length, json list
+of `(name, dtype)`, zero padding to `_ALIGN` bytes, records. The count is only
+updated when the log is synced (every `sync_every` rows, every `sync_interval_s`
+and on close), so after a crash the reader sees everything up to the last sync.
+"""
+
+_MAGIC = b'FISHOTS1'
+_HEADER = struct.Struct('<8sQI')
+_OFFSET_COUNT = 8
+_ALIGN = 64
+_GROW = 16384
+
+def _dtype_of(key, value, str_width):
+    if isinstance(value, (bool, np.bool_)):
+        return '?'
+    elif isinstance(value, str):
+        # Also `np.str_`, which would otherwise get the width of this first value
+        return f'S{str_width}'
+    elif isinstance(value, np.generic):
+        return value.dtype.str
+    elif isinstance(value, int):
+        return '<i8'
+    elif isinstance(value, float):
+        return '<f8'
+    else:
+        raise TypeError(f'cannot store {key}={value!r} ({type(value)=}) in a shot log')
+
+def _str_fields(dtype: np.dtype) -> "list[tuple[int, int]]":
+    # (position, width in characters) of the string fields
+    return [(i, dtype[i].itemsize // (4 if dtype[i].kind == 'U' else 1))
+            for i in range(len(dtype)) if dtype[i].kind in 'SU']
+
+def _read_header(f) -> "tuple[np.dtype, int, int]":
+    magic, count, header_len = _HEADER.unpack(f.read(_HEADER.size))
+    if magic != _MAGIC:
+        raise ValueError(f'not a shot log, {magic=}')
+    descr = json.loads(f.read(header_len))
+    offset = -(-(_HEADER.size + header_len) // _ALIGN) * _ALIGN
+    return np.dtype([tuple(d) for d in descr]), count, offset
+
+class ShotLog():
+    def __init__(self, fname, str_width: int=32, sync_every: int=1000, sync_interval_s: float=1.0) -> None:
+        self.fname = Path(fname)
+        self.str_width = str_width
+        self.sync_every = sync_every
+        self.sync_interval_s = sync_interval_s
+
+        self.dtype = None
+        self._str_fields = []
+        self.count = 0
+        self._f = None
+        self._mm = None
+        self._records = None
+        self._offset = 0
+        self._capacity = 0
+        self._synced = 0
+        self._t_sync = time.monotonic()
+
+        if self.fname.exists():
+            # Continue an existing log
+            self._f = open(self.fname, 'r+b')
+            self.dtype, self.count, self._offset = _read_header(self._f)
+            self._str_fields = _str_fields(self.dtype)
+            self._synced = self.count
+            self._map(max(self.count + _GROW, (self._f.seek(0, 2) - self._offset) // self.dtype.itemsize))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def _create(self, row: dict):
+        self.dtype = np.dtype([(k, _dtype_of(k, v, self.str_width)) for k, v in row.items()])
+        self._str_fields = _str_fields(self.dtype)
+        header = json.dumps(self.dtype.descr).encode()
+        self._offset = -(-(_HEADER.size + len(header)) // _ALIGN) * _ALIGN
+        self.fname.parent.mkdir(parents=True, exist_ok=True)
+        self._f = open(self.fname, 'w+b')
+        self._f.write(_HEADER.pack(_MAGIC, 0, len(header)) + header)
+        self._f.write(b'\0' * (self._offset - self._f.tell()))
+        self._map(_GROW)
+
+    def _map(self, capacity):
+        self._unmap()
+        self._f.truncate(self._offset + capacity * self.dtype.itemsize)
+        self._mm = mmap.mmap(self._f.fileno(), 0)
+        self._records = np.frombuffer(self._mm, dtype=self.dtype, count=capacity, offset=self._offset)
+        self._capacity = capacity
+
+    def _unmap(self):
+        if self._mm is not None:
+            # The numpy view holds a buffer export, drop it before closing the map
+            self._records = None
+            self._mm.flush()
+            self._mm.close()
+            self._mm = None
+
+    def append(self, row: dict):
+        if self.dtype is None:
+            self._create(row)
+        if self.count == self._capacity:
+            self.sync()
+            self._map(self._capacity * 2)
+        try:
+            record = tuple(row[k] for k in self.dtype.names)
+        except KeyError as e:
+            raise KeyError(f'row is missing {e} of the shot log layout') from None
+        # numpy silently truncates strings that do not fit their field
+        for i, width in self._str_fields:
+            if len(record[i]) > width:
+                raise ValueError(f'{self.dtype.names[i]}={record[i]!r} does not fit the {width} characters of '
+                                 f'its field, use a larger str_width')
+        self._records[self.count] = record
+        self.count += 1
+        if self.count - self._synced >= self.sync_every or time.monotonic() - self._t_sync > self.sync_interval_s:
+            self.sync()
+
+    def sync(self):
+        if self._mm is None:
+            return
+        # Records first, then the count that makes them visible
+        self._mm.flush()
+        struct.pack_into('<Q', self._mm, _OFFSET_COUNT, self.count)
+        self._mm.flush(0, mmap.PAGESIZE)
+        self._synced = self.count
+        self._t_sync = time.monotonic()
+
+    def close(self):
+        if self._f is None:
+            return
+        self.sync()
+        self._unmap()
+        # Drop the preallocated tail
+        self._f.truncate(self._offset + self.count * self.dtype.itemsize)
+        self._f.close()
+        self._f = None
+
+def shotlog_read(fname) -> np.ndarray:
+    """
+    Zero-copy, read-only view of the synced records of a shot log as a numpy
+    structured array. Can be used while the log is still being written.
+    """
+    with open(fname, 'rb') as f:
+        dtype, count, offset = _read_header(f)
+    if count == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(fname, dtype=dtype, mode='r', offset=offset, shape=(count,))
+
+def shotlog_to_db(fname, db_name: str, table: str, batch: int=10_000) -> int:
+    """
+    Convert a shot log into a run table with the same layout as `db_append_row`
+    would make from the original rows. Returns the number of rows converted.
+    """
+    records = shotlog_read(fname)
+    names = records.dtype.names
+    str_cols = [i for i, name in enumerate(names) if records.dtype[name].kind == 'S']
+
+    with closing(sqlite3.connect(db_name)) as db:
+        settings = db_setup(db, 'bulk')
+        for start in range(0, len(records), batch):
+            rows = []
+            for rec in records[start:start + batch].tolist():
+                rec = list(rec)
+                for i in str_cols:
+                    rec[i] = rec[i].decode()
+                rows.append(dict(zip(names, rec)))
+            db_append_row(db, table, rows, defer_index=settings['defer_index'])
+        if len(records):
+            db_create_indexes(db, table)
+    return len(records)
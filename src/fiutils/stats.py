@@ -0,0 +1,214 @@
+from bisect import bisect_left
+import math
+from typing import TYPE_CHECKING, Callable, Iterable, Union
+
+import numpy as np
+
+if TYPE_CHECKING:
+    # Only for the annotations, `frame` imports it when called
+    import pandas as pd
+
+"""
+Online glitch rate per bin of some of the parameters, while a campaign runs, to
+stop spending shots on bins that are known to (almost) never glitch.
+
+```
+stats = RateStats.from_params(params, ['glitch_v', 'glitch_time_ns'], bins=10, threshold=.001)
+for idx, settings in progress:
+    if not stats.keep_sampling(settings):
+        continue
+    ...
+    stats.update(settings, p.verdict)
+stats.frame()   # trials, successes and credible interval per bin
+```
+
+The bins are the ones `bin_cut` would make over the range of the parameters.
+The rate of a bin has a Beta posterior (Jeffreys prior by default), a bin is done
+once it had `min_trials` and the posterior probability that its rate is above
+`threshold` is below `1 - confidence`. Recording a shot and asking whether to
+keep sampling are O(1): the posterior is only looked at again when the trials of
+a bin have grown by 10%. A bin that is done stays done.
+"""
+
+def bin_edges(values: np.ndarray, bins: Union[int, Iterable[float]]=10) -> np.ndarray:
+    """
+    Edges of the bins of `pd.cut(values, bins)`: `bins` equal width bins over the
+    range of `values` (the first one extended by 0.1% of the range), or `bins` as is.
+    """
+    if np.ndim(bins):
+        return np.asarray(bins, dtype=float)
+    mn, mx = np.nanmin(values), np.nanmax(values)
+    if mn == mx:
+        adj = .001 * abs(mn) if mn != 0 else .001
+        return np.linspace(mn - adj, mx + adj, bins + 1)
+    edges = np.linspace(mn, mx, bins + 1)
+    edges[0] -= (mx - mn) * .001
+    return edges
+
+def zip_dim_bins(dims: Iterable[str], bins: Union[Iterable[int], int]) -> "Iterable[tuple[str, int]]":
+    """`(dim, bins of dim)` pairs, for `bins` given per dim or one for all dims like `bin_cut` takes it."""
+    try:
+        if len(bins) == len(dims):
+            # Have a bin per dim
+            return zip(dims, bins)
+        else:
+            raise ValueError(f'Do not like {bins=}')
+    except TypeError:
+        return zip(dims, [bins]*len(dims))
+
+def _betacf(a: float, b: float, x: float) -> float:
+    # Continued fraction of the incomplete beta function (modified Lentz)
+    tiny = 1e-300
+    c, d = 1.0, 1 - (a + b) * x / (a + 1)
+    d = 1 / (d if abs(d) > tiny else tiny)
+    h = d
+    for m in range(1, 10_000):
+        for aa in (m * (b - m) * x / ((a + 2 * m - 1) * (a + 2 * m)),
+                   -(a + m) * (a + b + m) * x / ((a + 2 * m) * (a + 2 * m + 1))):
+            d = 1 + aa * d
+            d = 1 / (d if abs(d) > tiny else tiny)
+            c = 1 + aa / c
+            c = c if abs(c) > tiny else tiny
+            h *= d * c
+        if abs(d * c - 1) < 1e-12:
+            break
+    return h
+
+def betainc(a: float, b: float, x: float) -> float:
+    """Regularized incomplete beta function, the CDF at `x` of a Beta(`a`, `b`) distribution."""
+    if x <= 0:
+        return 0.0
+    if x >= 1:
+        return 1.0
+    front = math.exp(math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b) + a * math.log(x) + b * math.log1p(-x))
+    if x < (a + 1) / (a + b + 2):
+        return front * _betacf(a, b, x) / a
+    return 1 - front * _betacf(b, a, 1 - x) / b
+
+def beta_ppf(q: float, a: float, b: float) -> float:
+    """Quantile `q` of a Beta(`a`, `b`) distribution, by bisection on `betainc`."""
+    lo, hi = 0.0, 1.0
+    for _ in range(60):
+        mid = (lo + hi) / 2
+        if betainc(a, b, mid) < q:
+            lo = mid
+        else:
+            hi = mid
+    return (lo + hi) / 2
+
+class RateStats():
+    def __init__(self, ranges: "dict[str, tuple[float, float]]", bins: Union[Iterable[int], int]=10,
+                 success: Callable=None, threshold: float=.001, confidence: float=.95, min_trials: int=20,
+                 prior: "tuple[float, float]"=(.5, .5)) -> None:
+        """
+        Trials and successes per bin of `ranges` (`{dim: (min, max)}`), `bins` like
+        `bin_cut` (per dim a number of bins or the edges). `success(verdict)` tells
+        whether a shot is a success, by default verdicts with 'GLITCH' in them.
+        """
+        self.dims = list(ranges)
+        self.edges = {dim: bin_edges(np.array(ranges[dim], dtype=float), bin) for dim, bin in zip_dim_bins(self.dims, bins)}
+        self.equal_width = {dim: not np.ndim(bin) for dim, bin in zip_dim_bins(self.dims, bins)}
+        self.shape = tuple(len(self.edges[dim]) - 1 for dim in self.dims)
+        self.success = success or (lambda verdict: 'GLITCH' in str(verdict))
+        self.threshold = threshold
+        self.confidence = confidence
+        self.min_trials = min_trials
+        self.prior = prior
+
+        # Plain lists, indexing numpy arrays one shot at a time is slower
+        size = int(np.prod(self.shape))
+        self.trials = [0] * size
+        self.successes = [0] * size
+        self.done = [False] * size
+        self._check = [min_trials] * size
+        # Per dim: (first edge, last edge, width, bins, edges as a list) for `_code`
+        self._bins = [(float(self.edges[dim][0]), float(self.edges[dim][-1]),
+                       (self.edges[dim][-1] - self.edges[dim][1]) / max(n - 1, 1), n,
+                       None if self.equal_width[dim] else self.edges[dim].tolist())
+                      for dim, n in zip(self.dims, self.shape)]
+
+    @classmethod
+    def from_params(cls, params: list, dims: Iterable[str], bins: Union[Iterable[int], int]=10, **kwargs) -> 'RateStats':
+        """`RateStats` over the ranges of `params` (`Parameter2D` dims are `name0` and `name1`)."""
+        ranges = {}
+        for param in params:
+            if param.itype == '2d':
+                (a_x, a_y), (b_x, b_y) = param.limits
+                ranges[f'{param.name}0'] = (a_x, b_x)
+                ranges[f'{param.name}1'] = (a_y, b_y)
+            else:
+                ranges[param.name] = (param.min, param.max)
+        return cls({dim: ranges[dim] for dim in dims}, bins, **kwargs)
+
+    def _code(self, value: float, first: float, last: float, width: float, n: int, edges: "list[float] | None") -> int:
+        # Code of the (right closed) bin of `value`, -1 outside of the bins, like `bin_codes`
+        if not first < value <= last:
+            return -1
+        if edges is not None:
+            return bisect_left(edges, value) - 1
+        if n == 1:
+            return 0
+        # The first bin is wider (like pd.cut), so count down from the top
+        return max(n - 1 - int((last - value) / width), 0)
+
+    def cell(self, settings: dict) -> int:
+        """Index of the bin of `settings`, -1 when they are outside of the bins."""
+        cell = 0
+        for dim, bins in zip(self.dims, self._bins):
+            code = self._code(float(settings[dim]), *bins)
+            if code < 0:
+                return -1
+            cell = cell * bins[3] + code
+        return cell
+
+    def keep_sampling(self, settings: dict) -> bool:
+        """False when the bin of `settings` is done, points outside of the bins are always sampled."""
+        cell = self.cell(settings)
+        return cell < 0 or not self.done[cell]
+
+    def update(self, settings: dict, verdict) -> int:
+        """Record a shot, returns its bin."""
+        cell = self.cell(settings)
+        if cell < 0:
+            return cell
+        self.trials[cell] += 1
+        if self.success(verdict):
+            self.successes[cell] += 1
+        if self.trials[cell] >= self._check[cell]:
+            self.done[cell] = self.done[cell] or self.p_above(cell) < 1 - self.confidence
+            self._check[cell] = math.ceil(self.trials[cell] * 1.1)
+        return cell
+
+    def posterior(self, cell: int) -> "tuple[float, float]":
+        # Parameters of the Beta posterior of the rate of `cell`
+        return self.prior[0] + self.successes[cell], self.prior[1] + self.trials[cell] - self.successes[cell]
+
+    def p_above(self, cell: int, threshold: float=None) -> float:
+        """Posterior probability that the rate of `cell` is above `threshold`."""
+        return 1 - betainc(*self.posterior(cell), self.threshold if threshold is None else threshold)
+
+    def interval(self, cell: int, level: float=None) -> "tuple[float, float]":
+        """Equal tailed credible interval of the rate of `cell`, at `level` (`confidence` by default)."""
+        tail = (1 - (self.confidence if level is None else level)) / 2
+        a, b = self.posterior(cell)
+        return beta_ppf(tail, a, b), beta_ppf(1 - tail, a, b)
+
+    def frame(self, level: float=None) -> 'pd.DataFrame':
+        """Trials, successes, posterior mean and credible interval of every bin that has trials."""
+        import pandas as pd
+        from .plot import bin_labels
+        trials, successes = np.array(self.trials), np.array(self.successes)
+        cells = np.flatnonzero(trials)
+        index = pd.MultiIndex.from_arrays(
+            [np.asarray(bin_labels(self.edges[dim]))[codes] for dim, codes in zip(self.dims, np.unravel_index(cells, self.shape))],
+            names=self.dims)
+        a, b = self.prior[0] + successes[cells], self.prior[1] + trials[cells] - successes[cells]
+        intervals = np.array([self.interval(cell, level) for cell in cells]).reshape(-1, 2)
+        return pd.DataFrame({
+            'trials': trials[cells],
+            'successes': successes[cells],
+            'rate': a / (a + b),
+            'lo': intervals[:, 0],
+            'hi': intervals[:, 1],
+            'done': np.array(self.done, dtype=bool)[cells],
+        }, index=index)
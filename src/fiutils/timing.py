@@ -0,0 +1,106 @@
+from collections import deque
+from time import perf_counter_ns
+
+from . import trace
+
+"""
+Per-stage shot timing.
+
+```
+timer = ShotTimer('reset', 'move', 'arm', 'trigger', 'classify')
+
+for idx, settings in progress:
+    p = SimpleNamespace(**settings)
+    shot = timer.shot(p)
+    with shot.span('arm'):
+        ...
+    with shot.span('trigger'):
+        ...
+    shot.done()                     # p.t_arm_ns, p.t_trigger_ns, ..., p.t_shot_ns
+
+    with timer.span('db'):          # not part of the row, only of the statistics
+        db_append_row(db, table_name, p.__dict__)
+
+lm.info(timer.summary())            # p50/p95/p99 per stage
+```
+
+Every declared stage gets a `t_<stage>_ns` column in every row (0 when it did not
+run in that shot, a stage that runs twice adds up), so all rows fit the same table.
+Next to that, the last `window` durations of every stage are kept for percentiles.
+Timing a span costs around a microsecond. Spans are also trace events, see `fiutils.trace`.
+"""
+
+class _Span():
+    __slots__ = ('_record', '_name', '_t0')
+
+    def __init__(self, record, name) -> None:
+        self._record = record
+        self._name = name
+
+    def __enter__(self):
+        self._t0 = perf_counter_ns()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        dt = perf_counter_ns() - self._t0
+        self._record(self._name, dt)
+        trace.complete(self._name, 'timing', self._t0, dt)
+
+class Shot():
+    def __init__(self, timer: 'ShotTimer', p) -> None:
+        self.timer = timer
+        self.p = p
+        self.durations = dict.fromkeys(timer.stages, 0)
+        self.t0 = perf_counter_ns()
+
+    def _record(self, name: str, dt: int):
+        self.durations[name] += dt
+
+    def span(self, name: str) -> _Span:
+        if name not in self.durations:
+            raise ValueError(f'{name=} is not one of the declared stages {self.timer.stages}')
+        return _Span(self._record, name)
+
+    def done(self) -> int:
+        # Store the durations in the shot, returns the duration of the whole shot
+        total = perf_counter_ns() - self.t0
+        for name, dt in self.durations.items():
+            setattr(self.p, f't_{name}_ns', dt)
+            if dt:
+                self.timer.record(name, dt)
+        self.p.t_shot_ns = total
+        self.timer.record('shot', total)
+        return total
+
+class ShotTimer():
+    def __init__(self, *stages: str, window: int=10_000) -> None:
+        self.stages = stages
+        self.window = window
+        self.windows = {}
+
+    def shot(self, p) -> Shot:
+        return Shot(self, p)
+
+    def span(self, name: str) -> _Span:
+        # Span outside of a shot, e.g. the db write, only kept for the statistics
+        return _Span(self.record, name)
+
+    def record(self, name: str, dt: int):
+        try:
+            self.windows[name].append(dt)
+        except KeyError:
+            self.windows[name] = deque([dt], maxlen=self.window)
+
+    def percentiles(self, qs: "tuple[float]"=(50, 95, 99)) -> "dict[str, list[int]]":
+        # Nearest-rank percentiles in ns, per stage, over the current windows
+        res = {}
+        for name, window in list(self.windows.items()):
+            values = sorted(window)
+            res[name] = [values[min(len(values) - 1, int(q / 100 * len(values)))] for q in qs]
+        return res
+
+    def summary(self) -> str:
+        lines = [f'{"stage":<12} {"p50_us":>10} {"p95_us":>10} {"p99_us":>10}']
+        for name, (p50, p95, p99) in self.percentiles().items():
+            lines.append(f'{name:<12} {p50 / 1e3:>10.1f} {p95 / 1e3:>10.1f} {p99 / 1e3:>10.1f}')
+        return '\n'.join(lines)
@@ -0,0 +1,139 @@
+import atexit
+from collections import deque
+from functools import wraps
+import inspect
+import json
+import os
+from pathlib import Path
+import threading
+from time import perf_counter_ns
+
+"""
+Trace events of a campaign, for viewing in chrome://tracing or https://ui.perfetto.dev
+(both read the Chrome trace JSON that is written here).
+
+```
+setup_trace(__file__, timestamp)   # logs/<script>/<timestamp>.trace.json at exit
+
+with span('arm', 'shot'):
+    ...
+```
+
+Tracing is off until `setup_trace` (or `trace_enable`) is called, and then costs
+one append to a ring buffer per event: only the last `size` events are kept.
+Already traced:
+- stages of `fiutils.timing` spans (so the campaign loop, and templates using `ShotTimer`)
+- `Spider` commands and `OpenOcd` RPCs, via the `traced` decorator
+- `db_append_row`
+"""
+
+_events = None
+_threads = {}
+
+def trace_enable(size: int=100_000):
+    global _events
+    _events = deque(maxlen=size)
+
+def trace_disable():
+    global _events
+    _events = None
+
+def _tid() -> int:
+    tid = threading.get_ident()
+    if tid not in _threads:
+        _threads[tid] = threading.current_thread().name
+    return tid
+
+def complete(name: str, cat: str, t0_ns: int, dt_ns: int, args: dict=None):
+    # Event that took `dt_ns` from `t0_ns` (a perf_counter_ns timestamp)
+    if _events is not None:
+        _events.append(('X', name, cat, t0_ns, dt_ns, _tid(), args))
+
+def instant(name: str, cat: str='', args: dict=None):
+    if _events is not None:
+        _events.append(('i', name, cat, perf_counter_ns(), 0, _tid(), args))
+
+def counter(name: str, values: dict):
+    # E.g. queue depths, shown as a graph over time
+    if _events is not None:
+        _events.append(('C', name, '', perf_counter_ns(), 0, _tid(), values))
+
+class _Span():
+    __slots__ = ('name', 'cat', 'args', '_t0')
+
+    def __init__(self, name, cat, args) -> None:
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+    def __enter__(self):
+        self._t0 = perf_counter_ns()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        complete(self.name, self.cat, self._t0, perf_counter_ns() - self._t0, self.args)
+
+class _NullSpan():
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        pass
+
+_NULL_SPAN = _NullSpan()
+
+def span(name: str, cat: str='', args: dict=None):
+    if _events is None:
+        return _NULL_SPAN
+    return _Span(name, cat, args)
+
+def traced(cat: str):
+    """
+    Decorator that traces every call of a function, or of every public method of
+    a class, as a span in `cat`.
+    """
+    def wrap(f, name):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            if _events is None:
+                return f(*args, **kwargs)
+            with _Span(name, cat, None):
+                return f(*args, **kwargs)
+        return wrapper
+
+    def decorator(obj):
+        if isinstance(obj, type):
+            for attr, value in list(vars(obj).items()):
+                if inspect.isfunction(value) and not attr.startswith('_'):
+                    setattr(obj, attr, wrap(value, f'{obj.__name__}.{attr}'))
+            return obj
+        return wrap(obj, obj.__name__)
+    return decorator
+
+def trace_export(fname) -> int:
+    """Write the events in the ring buffer as Chrome trace JSON, returns the number of events."""
+    events = list(_events or ())
+    pid = os.getpid()
+    out = [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}}
+           for tid, name in list(_threads.items())]
+    for ph, name, cat, t0_ns, dt_ns, tid, args in events:
+        event = {'name': name, 'cat': cat, 'ph': ph, 'ts': t0_ns / 1e3, 'pid': pid, 'tid': tid}
+        if ph == 'X':
+            event['dur'] = dt_ns / 1e3
+        elif ph == 'i':
+            event['s'] = 't'
+        if args:
+            event['args'] = args
+        out.append(event)
+
+    Path(fname).parent.mkdir(parents=True, exist_ok=True)
+    with open(fname, 'w') as f:
+        json.dump({'traceEvents': out, 'displayTimeUnit': 'ns'}, f, default=str)
+    return len(events)
+
+def setup_trace(fname, timestamp, size: int=100_000) -> Path:
+    # Trace this run, and write it next to its log file at exit
+    path = Path('logs') / f'{fname}' / f'{timestamp}.trace.json'
+    trace_enable(size)
+    atexit.register(trace_export, path)
+    return path
@@ -1,13 +1,19 @@
+import atexit
 from contextlib import closing
 import datetime
+import json
 import logging
+from logging.handlers import QueueHandler, QueueListener
 import os
 from pathlib import Path
+import queue
 import sqlite3
-from tqdm import tqdm
+import sys
+import threading
+import time
 
-from .db import db_get_hist
-from .params import pdump, pproduct, ptotal
+# tqdm, numpy (via .db and .params) are imported where they are needed, so that
+# `setup_logger` and `get_run_id` at the top of a script are cheap
 
 class CustomFormatter(logging.Formatter):
     """Logging Formatter to add colors and count warning / errors"""
@@ -28,12 +34,17 @@ class CustomFormatter(logging.Formatter):
         logging.CRITICAL: bold_red + "[C] %(name)s | %(message)s" + reset,
     }
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._formatters = {level: logging.Formatter(fmt) for level, fmt in self.FORMATS.items()}
+
     def format(self, record):
-        log_fmt = self.FORMATS.get(record.levelno)
-        formatter = logging.Formatter(log_fmt)
+        formatter = self._formatters.get(record.levelno, self)
+        if formatter is self:
+            return super().format(record)
         return formatter.format(record)
 
-class FileFormatter(logging.Formatter):
+class FileFormatter(CustomFormatter):
     FORMATS = {
         logging.DEBUG:    "[D] %(name)s | %(filename)s:%(lineno)d | %(message)s",
         logging.INFO:     "[I] %(name)s | %(message)s",
@@ -42,19 +53,55 @@ class FileFormatter(logging.Formatter):
         logging.CRITICAL: "[C] %(name)s | %(message)s",
     }
 
-    def format(self, record):
-        log_fmt = self.FORMATS.get(record.levelno)
-        formatter = logging.Formatter(log_fmt)
-        return formatter.format(record)
+class TqdmStreamHandler(logging.StreamHandler):
+    """StreamHandler that moves any tqdm progress bars out of the way while writing"""
+    def emit(self, record):
+        from tqdm import tqdm
+        with tqdm.external_write_mode(file=self.stream):
+            super().emit(record)
+
+def _queue_handler(handler: logging.Handler) -> QueueHandler:
+    # Formatting and I/O of `handler` happen on a listener thread, the logging
+    # thread only puts records on a queue. Stopping the listener at exit flushes it.
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.listener = listener
+    return queue_handler
+
+class RateLimiter():
+    """
+    True at most once every `interval_s` seconds, to log per-shot details without
+    flooding the logs (and the loop). The shots themselves go to the database.
+
+    ```
+    log_shot = RateLimiter(1.0)
+    ...
+    if log_shot():
+        lm.info(pformat(p))
+    ```
+    """
+    def __init__(self, interval_s: float=1.0) -> None:
+        self.interval_s = interval_s
+        self._t = -interval_s
+
+    def __call__(self) -> bool:
+        t = time.monotonic()
+        if t - self._t < self.interval_s:
+            return False
+        self._t = t
+        return True
 
 def setup_logger(name, file_name=None):
-    handler = logging.StreamHandler()
-    handler.setFormatter(CustomFormatter())
-    if name in name in logging.Logger.manager.loggerDict:
+    if name in logging.Logger.manager.loggerDict:
         return logging.getLogger(name)
+    handler = TqdmStreamHandler()
+    handler.setFormatter(CustomFormatter())
     logger = logging.getLogger(name)
     logger.setLevel(logging.INFO)
-    logger.addHandler(handler)
+    logger.addHandler(_queue_handler(handler))
     return logger
 
 def get_run_id(fallback):
@@ -73,25 +120,123 @@ def setup_file_logger(fname, timestamp):
     file_handler = logging.FileHandler(p / f'{timestamp}.log')
     file_handler.setFormatter(FileFormatter())
     root_logger = logging.getLogger()
-    root_logger.addHandler(file_handler)
+    root_logger.addHandler(_queue_handler(file_handler))
+
+def _db_names(fname, timestamp):
+    return f'data/{fname}-db2.db', f'tab_{timestamp}'
 
 def setup_db(fname, timestamp):
-    db_name = f'data/{fname}-db2.db'
-    table_name = f'tab_{timestamp}'
+    from .db import db_get_hist
+    db_name, table_name = _db_names(fname, timestamp)
 
     with closing(sqlite3.connect(db_name)) as db:
         hist = db_get_hist(db, table_name)
         print(hist)
     return db_name, table_name, hist
 
-
-
-
-
-def setup_params(fname, timestamp, *params, **kwargs):
-    # Setup a progress bar for the provided parameters, and store the config to disk
+def get_resume_idx(fname, timestamp) -> int:
+    """
+    Index of the first shot that is not in the run's table yet, i.e. where a
+    re-used timestamp continues. Everything up to the last committed row counts.
+    """
+    db_name, table_name = _db_names(fname, timestamp)
+    if not Path(db_name).exists():
+        return 0
+    with closing(sqlite3.connect(db_name)) as db:
+        res = db.execute("SELECT * FROM sqlite_master WHERE type='table' AND name=?", (table_name,))
+        if not res.fetchone():
+            return 0
+        last, = db.execute(f"SELECT max(idx) FROM '{table_name}'").fetchone()
+    return 0 if last is None else last + 1
+
+def setup_params(fname, timestamp, *params, resume=True, **kwargs):
+    """
+    Setup a progress bar for the provided parameters, and store the config to disk.
+    With `resume`, a re-used timestamp continues after the last shot in its table,
+    on the same progress bar.
+    """
+    from tqdm import tqdm
+    from .params import pdump, pproduct, ptotal
     path_params = Path('params') / fname
     path_params.mkdir(parents=True, exist_ok=True)
-    pdump(params, path_params / f'{timestamp}.json')
-    progress = tqdm(enumerate(pproduct(params)), total=ptotal(params), mininterval=1, ncols=80)
+    path_dump = path_params / f'{timestamp}.json'
+
+    start = get_resume_idx(fname, timestamp) if resume else 0
+    if start:
+        if path_dump.exists() and path_dump.read_text() != json.dumps([it.to_dict() for it in params], indent=4):
+            print(f'WARNING: parameters differ from {path_dump}, keeping the original dump')
+        print(f'resuming at idx={start}')
+    else:
+        pdump(params, path_dump)
+    progress = tqdm(enumerate(pproduct(params, start), start), initial=start, total=ptotal(params), mininterval=1, dynamic_ncols=True)
     return progress
+
+class Profiler():
+    """
+    Profile the loop thread for `shots` shots: cProfile for a `.pstats` file (open
+    with `python -m pstats` or snakeviz) and a stack sampler for a `.collapsed` file
+    (one `frame;frame;frame count` line per stack, for flamegraph.pl or speedscope).
+    Call `shot()` after every shot, the files are written after the last one (or at
+    exit, if the run ends earlier).
+    """
+    def __init__(self, path_base: Path, shots: int, interval_s: float=.005) -> None:
+        self.path_base = Path(path_base)
+        self.remaining = shots
+        self.interval_s = interval_s
+        self._profile = None
+        self._stacks = {}
+        self._stop = threading.Event()
+
+    def start(self):
+        import cProfile
+        self.path_base.parent.mkdir(parents=True, exist_ok=True)
+        self._tid = threading.get_ident()
+        self._thread = threading.Thread(target=self._sample, name='profiler', daemon=True)
+        self._profile = cProfile.Profile()
+        self._profile.enable()
+        self._thread.start()
+        atexit.register(self.stop)
+        return self
+
+    def _sample(self):
+        while not self._stop.wait(self.interval_s):
+            frame = sys._current_frames().get(self._tid)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            key = ';'.join(reversed(stack))
+            self._stacks[key] = self._stacks.get(key, 0) + 1
+
+    def shot(self):
+        if self.remaining:
+            self.remaining -= 1
+            if not self.remaining:
+                self.stop()
+
+    def stop(self):
+        if self._profile is None:
+            return
+        self._profile.disable()
+        self._stop.set()
+        self._thread.join()
+        self._profile.dump_stats(f'{self.path_base}.pstats')
+        with open(f'{self.path_base}.collapsed', 'w') as f:
+            for stack, count in self._stacks.items():
+                f.write(f'{stack} {count}\n')
+        self._profile = None
+        self.remaining = 0
+
+def setup_profiler(fname, timestamp, shots: int=None, **kwargs) -> Profiler:
+    """
+    Profile the first `shots` shots of the run to `logs/<script>/<timestamp>.pstats`
+    and `.collapsed`. Without `shots`, the `FIUTILS_PROFILE` environment variable is
+    used, so a script with this hook can be profiled without editing it:
+    `FIUTILS_PROFILE=1000 python script.py`. When neither is set, `shot()` does nothing.
+    """
+    shots = shots or int(os.environ.get('FIUTILS_PROFILE', 0))
+    profiler = Profiler(Path('logs') / f'{fname}' / f'{timestamp}', shots, **kwargs)
+    if shots:
+        profiler.start()
+    return profiler